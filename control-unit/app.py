@@ -2,6 +2,7 @@ from flask import Flask
 from extras.flask_restx import Api
 from controller import controlUnitController
 from cheroot.wsgi import Server
+import signal
 import os
 
 app = Flask(__name__)
@@ -17,9 +18,19 @@ BASE_PATH = "/api"
 
 api.add_namespace(controlUnitController.api, path=f"{BASE_PATH}/control")
 
+def handle_sigterm(signum, frame):
+    # docker stop invia SIGTERM: lo trattiamo come Ctrl+C per chiudere in modo ordinato
+    raise KeyboardInterrupt
+
 if __name__ == "__main__":
+    signal.signal(signal.SIGTERM, handle_sigterm)
+    controlUnitController.llm.start()
     server = Server(("0.0.0.0", 5500), app)
     try:
         server.start()
     except KeyboardInterrupt:
+        controlUnitController.llm.stop()
         server.stop()
+    finally:
+        # Salva le ultime misure non ancora persistite (persist() è limitato a una scrittura ogni LATENCY_PERSIST_INTERVAL)
+        controlUnitController.controller.latency_model.persist(force=True)
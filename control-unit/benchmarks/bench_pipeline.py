@@ -0,0 +1,226 @@
+"""
+Microbenchmark offline della pipeline del control unit.
+
+Misura l'overhead del control unit separatamente dalla latenza di LLM e agenti:
+Consul, catalog gateway, Ollama e agenti sono sostituiti da stub in-process con
+latenza e dimensione dei payload configurabili.
+
+Uso (dalla cartella control-unit):
+    python -m benchmarks.bench_pipeline
+    python -m benchmarks.bench_pipeline --stages control,extract_agents --concurrency 1,8,32
+    python -m benchmarks.bench_pipeline --latency-ms agent=5,ollama=50 --payload-bytes 16384 --json out.json
+"""
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import redirect_stdout
+from benchmarks.stubs import StubBackend, StubConfig, EchoLLM
+from service.controlService import Controller, sanitize_execution_results
+from service.llmService import LLMClient
+from service.latencyService import LatencyModel
+from service.workflowService import WorkflowRegistry
+import statistics
+import tracemalloc
+import tempfile
+import argparse
+import asyncio
+import shutil
+import json
+import time
+import os
+
+# ================= CONFIG =================
+DEFAULT_ITERATIONS = 200
+DEFAULT_WARMUP = 10
+DEFAULT_ALLOC_ITERATIONS = 20
+DEFAULT_CONCURRENCY = "1,4,16"
+# ==========================================
+
+
+def build_stages(backend, files_root):
+    """Ritorna le funzioni da misurare, una per stadio della pipeline."""
+    catalog = backend.catalog_results()["results"]
+    discovered_services = [
+        {"_id": s["_id"], "name": s["name"], "description": s["description"]} for s in catalog
+    ]
+    discovered_capabilities = [s["capabilities"] for s in catalog]
+    discovered_endpoints = [s["endpoints"] for s in catalog]
+    task = backend.plan()["tasks"][0]
+    llm_text = backend.llm_response()
+    execution_results = [
+        {"task_name": "task 0", "status": "SUCCESS", "status_code": 200, "result": "y" * backend.config.payload_bytes},
+        {"status": "FILE", "status_code": 200, "headers": {}, "body": b"0" * backend.config.pdf_bytes}
+    ]
+
+    latency_model = LatencyModel(path=os.path.join(files_root, "latency_model.json"))
+    workflows = WorkflowRegistry(path=os.path.join(files_root, "workflows.json"))
+    controller = Controller(
+        llm=LLMClient(url=backend.url, models=["stub"]),
+        catalog_url=backend.url,
+        registry_url=backend.url,
+        files_root=files_root,
+        latency_model=latency_model,
+        workflows=workflows
+    )
+    prompt_controller = Controller(
+        llm=EchoLLM(llm_text),
+        catalog_url=backend.url,
+        registry_url=backend.url,
+        files_root=files_root,
+        latency_model=latency_model,
+        workflows=workflows
+    )
+
+    def call_agent():
+        return asyncio.run(controller.trigger_agents_async({"tasks": [task]}, discovered_services))
+
+    return {
+        "control": lambda: controller.control("stub query"),
+        "extract_agents": lambda: controller.extract_agents(llm_text),
+        "decompose_task": lambda: prompt_controller.decompose_task(
+            discovered_services, discovered_capabilities, discovered_endpoints, "stub query", []
+        ),
+        "call_agent_sync": lambda: controller.call_agent_sync(task, discovered_services),
+        "call_agent": call_agent,
+        "sanitize_execution_results": lambda: sanitize_execution_results(execution_results),
+    }
+
+
+def measure_sequential(fn, iterations, warmup):
+    for _ in range(warmup):
+        fn()
+
+    wall_samples = []
+    cpu_start = time.thread_time()
+    for _ in range(iterations):
+        start = time.perf_counter()
+        fn()
+        wall_samples.append(time.perf_counter() - start)
+    cpu = time.thread_time() - cpu_start
+
+    wall_samples.sort()
+    return {
+        "wall_mean_ms": statistics.fmean(wall_samples) * 1000,
+        "wall_p95_ms": wall_samples[int(0.95 * (len(wall_samples) - 1))] * 1000,
+        "cpu_per_call_ms": cpu / iterations * 1000,
+    }
+
+
+def measure_allocations(fn, iterations):
+    peaks = []
+    retained = []
+    tracemalloc.start()
+    try:
+        for _ in range(iterations):
+            before, _ = tracemalloc.get_traced_memory()
+            tracemalloc.reset_peak()
+            fn()
+            after, peak = tracemalloc.get_traced_memory()
+            peaks.append(peak - before)
+            retained.append(after - before)
+    finally:
+        tracemalloc.stop()
+    return {
+        "alloc_peak_kib": statistics.fmean(peaks) / 1024,
+        "alloc_retained_kib": statistics.fmean(retained) / 1024,
+    }
+
+
+def measure_throughput(fn, iterations, concurrency):
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        start = time.perf_counter()
+        cpu_start = time.process_time()
+        list(pool.map(lambda _: fn(), range(iterations)))
+        wall = time.perf_counter() - start
+        cpu = time.process_time() - cpu_start
+    return {
+        "ops_per_s": iterations / wall,
+        "process_cpu_per_call_ms": cpu / iterations * 1000,
+    }
+
+
+def run(stage_names, iterations, warmup, alloc_iterations, concurrency_levels, config):
+    report = {}
+    files_root = tempfile.mkdtemp(prefix="bench-files-")
+    try:
+        with StubBackend(config) as backend, open(os.devnull, "w") as devnull, redirect_stdout(devnull):
+            stages = build_stages(backend, files_root)
+            for name in stage_names:
+                fn = stages[name]
+                result = measure_sequential(fn, iterations, warmup)
+                result.update(measure_allocations(fn, alloc_iterations))
+                result["throughput"] = {
+                    str(c): measure_throughput(fn, iterations, c) for c in concurrency_levels
+                }
+                report[name] = result
+    finally:
+        shutil.rmtree(files_root, ignore_errors=True)
+    return report
+
+
+def print_report(report, concurrency_levels):
+    header = f"{'stage':<28}{'wall ms':>10}{'p95 ms':>10}{'cpu ms':>10}{'peak KiB':>10}{'kept KiB':>10}"
+    header += "".join(f"{'ops/s@' + str(c):>12}" for c in concurrency_levels)
+    print(header)
+    print("=" * len(header))
+    for name, r in report.items():
+        line = (
+            f"{name:<28}{r['wall_mean_ms']:>10.3f}{r['wall_p95_ms']:>10.3f}{r['cpu_per_call_ms']:>10.3f}"
+            f"{r['alloc_peak_kib']:>10.1f}{r['alloc_retained_kib']:>10.1f}"
+        )
+        line += "".join(f"{r['throughput'][str(c)]['ops_per_s']:>12.1f}" for c in concurrency_levels)
+        print(line)
+
+
+def parse_latency(value):
+    latency = {}
+    for item in filter(None, value.split(",")):
+        key, ms = item.split("=", 1)
+        latency[key.strip()] = float(ms) / 1000
+    return latency
+
+
+def main():
+    stage_names = [
+        "control", "extract_agents", "decompose_task",
+        "call_agent_sync", "call_agent", "sanitize_execution_results"
+    ]
+
+    parser = argparse.ArgumentParser(description="Control unit pipeline microbenchmarks")
+    parser.add_argument("--stages", default=",".join(stage_names), help="Comma separated stages to run")
+    parser.add_argument("--iterations", type=int, default=DEFAULT_ITERATIONS)
+    parser.add_argument("--warmup", type=int, default=DEFAULT_WARMUP)
+    parser.add_argument("--alloc-iterations", type=int, default=DEFAULT_ALLOC_ITERATIONS)
+    parser.add_argument("--concurrency", default=DEFAULT_CONCURRENCY, help="Comma separated thread counts")
+    parser.add_argument("--latency-ms", default="", help="Stub latency, e.g. consul=1,catalog=5,ollama=50,agent=5")
+    parser.add_argument("--services", type=int, default=20, help="Services returned by the catalog stub")
+    parser.add_argument("--tasks", type=int, default=2, help="Tasks in the stub execution plan")
+    parser.add_argument("--payload-bytes", type=int, default=1024, help="Size of catalog/agent text payloads")
+    parser.add_argument("--pdf-bytes", type=int, default=64 * 1024, help="Size of file results")
+    parser.add_argument("--pdf", action="store_true", help="End the stub plan with a task returning a PDF")
+    parser.add_argument("--json", help="Write the full report to this path")
+    args = parser.parse_args()
+
+    selected = [s.strip() for s in args.stages.split(",") if s.strip()]
+    unknown = [s for s in selected if s not in stage_names]
+    if unknown:
+        parser.error(f"Unknown stages: {', '.join(unknown)}")
+
+    concurrency_levels = [int(c) for c in args.concurrency.split(",") if c.strip()]
+    config = StubConfig(
+        services=args.services,
+        payload_bytes=args.payload_bytes,
+        pdf_bytes=args.pdf_bytes,
+        tasks=args.tasks,
+        pdf=args.pdf,
+        latency=parse_latency(args.latency_ms)
+    )
+
+    report = run(selected, args.iterations, args.warmup, args.alloc_iterations, concurrency_levels, config)
+    print_report(report, concurrency_levels)
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,183 @@
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+import threading
+import json
+import time
+
+class StubConfig:
+    """
+    Configurazione degli stub in-process: latenza (in secondi) per ciascun
+    backend e dimensione dei payload restituiti.
+    """
+
+    def __init__(self, services=20, payload_bytes=1024, pdf_bytes=64 * 1024, tasks=2, pdf=False, latency=None):
+        self.services = services
+        self.payload_bytes = payload_bytes
+        self.pdf_bytes = pdf_bytes
+        self.tasks = tasks
+        self.pdf = pdf
+        self.latency = {"consul": 0.0, "catalog": 0.0, "ollama": 0.0, "agent": 0.0}
+        self.latency.update(latency or {})
+
+
+class StubBackend:
+    """
+    Un unico server HTTP che simula Consul, il catalog gateway, Ollama e gli agenti.
+    Le rotte sono le stesse usate dal control unit, per cui basta puntare
+    REGISTRY_URL, CATALOG_URL e OLLAMA_API_URL a `self.url`.
+    """
+
+    def __init__(self, config=None):
+        self.config = config or StubConfig()
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), self._handler())
+        self.server.daemon_threads = True
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}"
+        self._thread = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def start(self):
+        self._thread = threading.Thread(target=self.server.serve_forever, name="stub-backend", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    # ---------- Payloads ----------
+
+    def service_ids(self):
+        return [f"svc-{i:03d}" for i in range(self.config.services)]
+
+    def consul_services(self):
+        return {
+            sid: {"ID": sid, "Service": f"service-{sid}", "Meta": {"service_doc_id": sid}}
+            for sid in self.service_ids()
+        }
+
+    def health_service(self, name):
+        sid = name[len("service-"):]
+        port = self.server.server_address[1]
+        return [{
+            "Node": {"Node": "stub", "Address": "127.0.0.1", "Datacenter": "dc1"},
+            "Service": {"ID": sid, "Service": name, "Address": "127.0.0.1", "Port": port, "Meta": {"service_doc_id": sid}}
+        }]
+
+    def catalog_results(self):
+        filler = "x" * self.config.payload_bytes
+        results = []
+        for sid in self.service_ids():
+            op = f"POST /agent/{sid}/invoke"
+            results.append({
+                "_id": sid,
+                "name": f"service-{sid}",
+                "description": f"Stub service {sid} {filler}",
+                "capabilities": {op: f"Answer questions about {sid}"},
+                "endpoints": {op: f"{self.url}/agent/{sid}/invoke"}
+            })
+        return {"results": results}
+
+    def plan(self, pdf=False):
+        tasks = []
+        for i, sid in enumerate(self.service_ids()[:self.config.tasks]):
+            tasks.append({
+                "task_name": f"task {i}",
+                "service_id": sid,
+                "endpoint": f"{self.url}/agent/{sid}/invoke",
+                "input": f"[TEXT]question {i}[/TEXT]",
+                "operation": "POST"
+            })
+        if pdf:
+            tasks.append({
+                "task_name": "render pdf",
+                "service_id": "svc-pdf",
+                "endpoint": f"{self.url}/agent/svc-pdf/pdf",
+                "input": "[TEXT]render[/TEXT]",
+                "operation": "GET"
+            })
+        return {"tasks": tasks}
+
+    def llm_response(self, pdf=False):
+        return "<think>stub reasoning</think>\n" + json.dumps(self.plan(pdf=pdf))
+
+    # ---------- HTTP ----------
+
+    def _handler(self):
+        backend = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            disable_nagle_algorithm = True
+
+            def log_message(self, format, *args):
+                pass
+
+            def _read_body(self):
+                length = int(self.headers.get("Content-Length") or 0)
+                return self.rfile.read(length) if length else b""
+
+            def _send(self, status, body, content_type="application/json"):
+                if not isinstance(body, bytes):
+                    body = json.dumps(body).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def _route(self):
+                self._read_body()
+                path = self.path.split("?", 1)[0]
+                latency = backend.config.latency
+
+                if path == "/v1/agent/services":
+                    time.sleep(latency["consul"])
+                    return self._send(200, backend.consul_services())
+                if path.startswith("/v1/health/service/"):
+                    time.sleep(latency["consul"])
+                    return self._send(200, backend.health_service(path.rsplit("/", 1)[1]))
+                if path == "/index/search":
+                    time.sleep(latency["catalog"])
+                    return self._send(200, backend.catalog_results())
+                if path == "/v1/chat/completions":
+                    time.sleep(latency["ollama"])
+                    content = backend.llm_response(pdf=backend.config.pdf)
+                    return self._send(200, {"choices": [{"message": {"content": content}}]})
+                if path == "/api/chat":
+                    time.sleep(latency["ollama"])
+                    content = backend.llm_response(pdf=backend.config.pdf)
+                    return self._send(200, {"message": {"role": "assistant", "content": content}, "load_duration": 0})
+                if path == "/api/generate":
+                    time.sleep(latency["ollama"])
+                    return self._send(200, {"response": "", "load_duration": 0})
+                if path.startswith("/agent/") and path.endswith("/pdf"):
+                    time.sleep(latency["agent"])
+                    return self._send(200, b"%PDF-1.4\n" + b"0" * backend.config.pdf_bytes, "application/pdf")
+                if path.startswith("/agent/"):
+                    time.sleep(latency["agent"])
+                    return self._send(200, {"response": "y" * backend.config.payload_bytes})
+                return self._send(404, {"error": "not found"})
+
+            do_GET = _route
+            do_POST = _route
+            do_PUT = _route
+            do_DELETE = _route
+
+        return Handler
+
+
+class EchoLLM:
+    """LLM client in-process: restituisce una risposta fissa senza passare dalla rete."""
+
+    def __init__(self, response):
+        self.response = response
+
+    def chat(self, prompt, model=None, history=None):
+        return self.response, 0.0
+
+    def is_ready(self):
+        return True
@@ -1,13 +1,18 @@
 from flask import request, jsonify, Response
 from extras.flask_restx import Namespace, Resource, reqparse, inputs
 from werkzeug.datastructures import FileStorage, ImmutableDict
-from service.controlService import Controller
+from service.controlService import Controller, sanitize_execution_results
+from service.llmService import LLMClient
+from service.metricsService import metrics
 import json
 import uuid
 import os
 
 api = Namespace("control", description="Services management and orchestration")
 
+llm = LLMClient()
+controller = Controller(llm=llm)
+
 control_parser = api.parser()
 
 control_parser.add_argument(
@@ -27,6 +32,34 @@ control_parser.add_argument(
     help='User input text'
 )
 
+control_parser.add_argument(
+    'session_id',
+    type=str,
+    location='form',
+    required=False,
+    help="Session id returned by a previous call, or 'new' to start a session"
+)
+
+control_parser.add_argument(
+    'refresh',
+    type=inputs.boolean,
+    location='form',
+    required=False,
+    default=False,
+    help='Within a session, discover services again instead of reusing them'
+)
+
+control_parser.add_argument(
+    'response_format',
+    type=str,
+    location='form',
+    required=False,
+    choices=('header', 'multipart'),
+    help="How file results carry the execution metadata: 'header' (X-Execution-Metadata) "
+         "or 'multipart' (multipart/mixed with a JSON part and the streamed file). "
+         "'multipart' is also selected by 'Accept: multipart/mixed'."
+)
+
 @api.route("/invoke")
 class ConversationalAgent(Resource):
     @api.expect(control_parser)
@@ -35,25 +68,44 @@ class ConversationalAgent(Resource):
         user_input = args['input']
         file_input = args['file']
 
-        controller = Controller()
-        results = controller.control(user_input, file_input)
+        try:
+            context = controller.new_context(args['session_id'], args['refresh'])
+        except ValueError as e:
+            return {"error": str(e)}, 400
+
+        multipart = args['response_format'] == 'multipart' or (
+            args['response_format'] is None and "multipart/mixed" in request.headers.get("Accept", "")
+        )
+        context.stream_files = multipart
+
+        results = controller.control(user_input, file_input, context)
+        session_id = context.session.id if context.session is not None else None
 
         if not isinstance(results, Response):
+            if session_id is not None:
+                results["session_id"] = session_id
             return jsonify(results)
 
-        pdf_bytes = results.get_data()
         content_disposition = results.headers.get(
             "Content-Disposition",
             'attachment; filename="output.pdf"'
         )
 
-        execution_results_sanitized = self.sanitize_execution_results(controller.execution_results)
+        execution_results_sanitized = sanitize_execution_results(context.execution_results)
 
         execution_metadata = {
-            "execution_plan": getattr(controller, "execution_plan", None),
+            "execution_plan": context.execution_plan,
             "execution_results": execution_results_sanitized,
+            "estimated_latency": context.estimated_latency,
             "note": "PDF generated successfully"
         }
+        if session_id is not None:
+            execution_metadata["session_id"] = session_id
+
+        if multipart:
+            return self.multipart_response(results, execution_metadata, content_disposition)
+
+        pdf_bytes = results.get_data()
 
         response = Response(
             pdf_bytes,
@@ -62,25 +114,103 @@ class ConversationalAgent(Resource):
         )
 
         response.headers["Content-Disposition"] = content_disposition
+        if session_id is not None:
+            response.headers["X-Session-Id"] = session_id
         response.headers["X-Execution-Metadata"] = json.dumps(execution_metadata)
 
         return response
 
-    def sanitize_execution_results(self, results):
-        if isinstance(results, list):
-            sanitized = []
-            for r in results:
-                if isinstance(r, dict):
-                    r_copy = r.copy()
-                    if r_copy.get("status") == "FILE" and "body" in r_copy:
-                        r_copy["body"] = f"<{len(r_copy['body'])} bytes>"
-                    sanitized.append(r_copy)
-                else:
-                    sanitized.append(r)
-            return sanitized
-        elif isinstance(results, dict):
-            r_copy = results.copy()
-            if r_copy.get("status") == "FILE" and "body" in r_copy:
-                r_copy["body"] = f"<{len(r_copy['body'])} bytes>"
-            return r_copy
-        return results
+    def multipart_response(self, results, execution_metadata, content_disposition):
+        """
+        Risposta multipart/mixed: una parte JSON con piano e metadati, seguita dal file
+        inoltrato in streaming dall'agente. Gli header hanno dimensione costante.
+        """
+        boundary = uuid.uuid4().hex
+        content_type = results.headers.get("Content-Type", "application/pdf")
+        file_body = results.response
+
+        def generate():
+            yield (
+                f"--{boundary}\r\n"
+                f"Content-Type: application/json\r\n\r\n"
+            ).encode("utf-8")
+            yield json.dumps(execution_metadata).encode("utf-8")
+            yield (
+                f"\r\n--{boundary}\r\n"
+                f"Content-Type: {content_type}\r\n"
+                f"Content-Disposition: {content_disposition}\r\n\r\n"
+            ).encode("utf-8")
+            for chunk in file_body:
+                yield chunk
+            yield f"\r\n--{boundary}--\r\n".encode("utf-8")
+
+        return Response(
+            generate(),
+            status=200,
+            mimetype=f"multipart/mixed; boundary={boundary}"
+        )
+
+
+@api.route("/health")
+class Healthcheck(Resource):
+    @api.doc(summary="Readiness check", description="Return HTTP 200 once the LLM models have been prewarmed")
+    def get(self):
+        if llm.is_ready():
+            return {"status": "ok"}, 200
+        return {"status": "warming up"}, 503
+
+
+@api.route("/metrics")
+class Metrics(Resource):
+    @api.doc(summary="Metrics", description="Return the control unit counters and latency summaries")
+    def get(self):
+        snapshot = metrics.snapshot()
+        snapshot["latency_model"] = controller.latency_model.snapshot()
+        snapshot["outstanding_requests"] = controller.balancer.snapshot()
+        return snapshot, 200
+
+
+@api.route("/workflows")
+class Workflows(Resource):
+    @api.doc(summary="List workflows", description="Return the latest version of every registered workflow template")
+    def get(self):
+        return controller.workflows.list(), 200
+
+    @api.doc(summary="Register workflow", description="""
+    Register a named, parameterized workflow template. Registering an existing
+    name stores a new version; queries always match the latest one.
+    """)
+    def post(self):
+        definition = request.get_json(force=True, silent=True)
+        try:
+            stored = controller.workflows.register(definition)
+        except ValueError as e:
+            return {"error": str(e)}, 400
+        return stored, 201
+
+
+@api.route("/workflows/<string:name>")
+class Workflow(Resource):
+    @api.doc(summary="Get workflow", params={"version": "Optional version, latest if omitted"})
+    def get(self, name):
+        version = request.args.get("version", type=int)
+        workflow = controller.workflows.get(name, version)
+        if workflow is None:
+            return {"error": "Workflow not found"}, 404
+        return workflow, 200
+
+    @api.doc(summary="Delete workflow", params={"version": "Optional version, all versions if omitted"})
+    def delete(self, name):
+        version = request.args.get("version", type=int)
+        if not controller.workflows.delete(name, version):
+            return {"error": "Workflow not found"}, 404
+        return {"status": "deleted", "name": name, "version": version}, 200
+
+
+@api.route("/sessions/<string:session_id>")
+class Session(Resource):
+    @api.doc(summary="End session", description="Drop the cached services, files and plan history of a session")
+    def delete(self, session_id):
+        if not controller.sessions.delete(session_id):
+            return {"error": "Session not found"}, 404
+        return {"status": "deleted", "session_id": session_id}, 200
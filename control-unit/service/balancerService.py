@@ -0,0 +1,98 @@
+from contextlib import contextmanager
+from urllib.parse import urlsplit, urlunsplit
+import threading
+import random
+import os
+
+IDEMPOTENT_OPERATIONS = {"GET", "PUT", "DELETE", "HEAD"}
+
+class LoadBalancer:
+    """
+    Sceglie, per ogni task, una delle istanze healthy registrate su Consul per il
+    servizio, con politica least-outstanding-requests e preferenza per le istanze locali.
+    """
+
+    def __init__(self, discovery):
+        self.discovery = discovery
+        self.enabled = os.environ.get("LB_ENABLED", "1") != "0"
+        self.local_node = os.environ.get("LB_LOCAL_NODE")
+        self.local_zone = os.environ.get("LB_LOCAL_ZONE")
+        self.locality_slack = int(os.environ.get("LB_LOCALITY_SLACK", 2))
+        self.max_retries = int(os.environ.get("LB_MAX_RETRIES", 2))
+
+        self._lock = threading.Lock()
+        self._outstanding = {}
+
+    @staticmethod
+    def instance_key(instance):
+        return f"{instance['address']}:{instance['port']}"
+
+    def is_local(self, instance):
+        if self.local_node and instance.get("node") == self.local_node:
+            return True
+        if self.local_zone and instance.get("zone") == self.local_zone:
+            return True
+        return False
+
+    def pick(self, service_id, exclude=()):
+        if not self.enabled or not service_id:
+            return None
+        try:
+            instances = self.discovery.healthy_instances(service_id)
+        except Exception as e:
+            print(f"[BALANCER] Cannot resolve instances of '{service_id}': {e}")
+            return None
+
+        candidates = [i for i in instances if self.instance_key(i) not in exclude]
+        if not candidates:
+            return None
+
+        with self._lock:
+            load = {self.instance_key(i): self._outstanding.get(self.instance_key(i), 0) for i in candidates}
+
+        def least_loaded(group):
+            if not group:
+                return None
+            lowest = min(load[self.instance_key(i)] for i in group)
+            return random.choice([i for i in group if load[self.instance_key(i)] == lowest])
+
+        best_local = least_loaded([i for i in candidates if self.is_local(i)])
+        best_remote = least_loaded([i for i in candidates if not self.is_local(i)])
+
+        if best_local is None:
+            return best_remote
+        if best_remote is None:
+            return best_local
+        if load[self.instance_key(best_local)] <= load[self.instance_key(best_remote)] + self.locality_slack:
+            return best_local
+        return best_remote
+
+    @contextmanager
+    def track(self, instance):
+        if instance is None:
+            yield
+            return
+        key = self.instance_key(instance)
+        with self._lock:
+            self._outstanding[key] = self._outstanding.get(key, 0) + 1
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._outstanding[key] -= 1
+                if self._outstanding[key] <= 0:
+                    del self._outstanding[key]
+
+    @staticmethod
+    def rewrite(endpoint, instance):
+        if instance is None:
+            return endpoint
+        parts = urlsplit(endpoint)
+        return urlunsplit((parts.scheme, f"{instance['address']}:{instance['port']}", parts.path, parts.query, parts.fragment))
+
+    def can_retry(self, operation, attempt):
+        return operation in IDEMPOTENT_OPERATIONS and attempt < self.max_retries
+
+    def snapshot(self):
+        with self._lock:
+            return dict(self._outstanding)
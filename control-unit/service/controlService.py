@@ -1,4 +1,11 @@
 from service.discoveryService import Discovery
+from service.llmService import LLMClient
+from service.latencyService import LatencyModel, PlanSchedule
+from service.balancerService import LoadBalancer
+from service.workflowService import WorkflowRegistry
+from service.sessionService import SessionStore
+from service.metricsService import metrics
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 from flask import Response
 import json
 import requests
@@ -9,22 +16,111 @@ import os
 import mimetypes
 import shutil
 import time
+import uuid
+import heapq
+import hashlib
+
+class ExecutionContext:
+    """
+    Stato di una singola invocazione: piano, risultati e cartella dei file caricati.
+    Il Controller è condiviso tra i thread, per cui nulla di tutto questo vive sull'istanza.
+    """
+
+    def __init__(self, files_root="Files", session=None, refresh=False):
+        self.request_id = str(uuid.uuid4())
+        self.session = session
+        self.refresh = refresh
+        if session is not None:
+            self.files_dir = session.files_dir
+        else:
+            self.files_dir = os.path.join(files_root, self.request_id)
+        self.execution_plan = {}
+        self.execution_results = []
+        self.plan_latency = None
+        self.estimated_latency = None
+        self.workflow = None
+        self.stream_files = False
+
+def sanitize_execution_results(results):
+    """Sostituisce i corpi dei risultati FILE con un segnaposto, per i metadati della risposta."""
+    if isinstance(results, list):
+        sanitized = []
+        for r in results:
+            if isinstance(r, dict):
+                sanitized.append(sanitize_file_result(r))
+            else:
+                sanitized.append(r)
+        return sanitized
+    elif isinstance(results, dict):
+        return sanitize_file_result(results)
+    return results
+
+def sanitize_file_result(result):
+    r_copy = result.copy()
+    if r_copy.get("status") == "FILE":
+        if "body" in r_copy:
+            r_copy["body"] = f"<{len(r_copy['body'])} bytes>"
+        if "stream" in r_copy:
+            r_copy.pop("stream")
+            r_copy["body"] = "<streamed>"
+    return r_copy
 
 class Controller:
 
-    def __init__(self):
+    def __init__(self, llm=None, catalog_url=None, registry_url=None, files_root="Files", latency_model=None, workflows=None):
         self.model_name = "phi4-reasoning:14b"
-        os.makedirs("Files", exist_ok=True)
+        self.llm = llm or LLMClient(models=[self.model_name])
+        self.catalog_url = catalog_url or os.environ.get("CATALOG_URL")
+        self.registry = Discovery(registry_url or os.environ.get("REGISTRY_URL"))
+        self.files_root = files_root
+        self.http = requests.Session()
+        self.latency_model = latency_model or LatencyModel()
+        self.balancer = LoadBalancer(self.registry)
+        self.workflows = workflows or WorkflowRegistry()
+        self.sessions = SessionStore(self.files_root)
+        # Override opzionali di numero di candidati e budget di token della ricerca a catalogo
+        self.search_k = int(os.environ.get("SEARCH_K", 0))
+        self.search_max_tokens = int(os.environ.get("SEARCH_MAX_TOKENS", 0))
+        self.max_concurrency = max(1, int(os.environ.get("AGENT_MAX_CONCURRENCY", 4)))
+        # Endpoint che hanno già restituito un FILE (chiavi di LatencyModel.key)
+        self.file_endpoints = set()
+        self.executor = ThreadPoolExecutor(
+            max_workers=int(os.environ.get("AGENT_POOL_SIZE", 32)),
+            thread_name_prefix="agent"
+        )
+        os.makedirs(self.files_root, exist_ok=True)
 
-    def analyze_files(self, files: list):
+    def new_context(self, session_id=None, refresh=False):
+        session = None
+        if session_id:
+            session = self.sessions.get_or_create(None if session_id == "new" else session_id)
+        return ExecutionContext(self.files_root, session=session, refresh=refresh)
+
+    def files_dir(self, context=None):
+        return context.files_dir if context is not None else self.files_root
+
+    def analyze_files(self, files: list, context=None):
         analyzed = []
 
         if files:
+            files_dir = self.files_dir(context)
+            session = context.session if context is not None else None
+            os.makedirs(files_dir, exist_ok=True)
             for f in files:
                 filename = f.filename
                 content_type = f.mimetype or mimetypes.guess_type(filename)[0]
                 size = f.content_length
-                path = os.path.join("Files", filename)
+                path = os.path.join(files_dir, filename)
+
+                digest = None
+                if session is not None:
+                    digest = self.file_digest(f)
+                    cached = session.files.get(digest)
+                    if cached is not None and cached["info"]["filename"] == filename and os.path.exists(path):
+                        metrics.incr("session_file_hits_total")
+                        analyzed.append(cached["info"])
+                        continue
+
                 f.save(path)
 
                 file_info = {
@@ -43,48 +139,63 @@ class Controller:
                 else:
                     file_info["category"] = "unknown"
 
+                if digest is not None:
+                    session.files = {d: c for d, c in session.files.items() if c["info"]["filename"] != filename}
+                    session.files[digest] = {"info": file_info, "bytes": os.path.getsize(path)}
+
                 analyzed.append(file_info)
 
         return analyzed
 
      
-    def query_ollama(self, prompt: str) -> str:
-        url = os.environ.get("OLLAMA_API_URL", "http://localhost:11434")
-        try:
-            start_time = time.perf_counter()
-            response = requests.post(
-                f"{url}/v1/chat/completions",
-                json={
-                    "messages": [
-                        {
-                            "role": "system",
-                            "content": ""
-                        },
-                        {
-                            "role": "user",
-                            "content": prompt
-                        }
-                    ],
-                    "temperature": 0,
-                    "max_tokens": 4096
-                    }
-            )
-            response.raise_for_status()
-            end_time = time.perf_counter()
+    def file_digest(self, f):
+        sha = hashlib.sha256()
+        for chunk in iter(lambda: f.stream.read(1024 * 1024), b""):
+            sha.update(chunk)
+        f.stream.seek(0)
+        return sha.hexdigest()
+
+    def query_ollama(self, prompt: str, history=None) -> str:
+        return self.llm.chat(prompt, model=self.model_name, history=history)
+
+
+    def decompose_task(self, discovered_services, discovered_capabilities, discovered_endpoints, query, input_files=None, session=None):
+        """
+        Nelle sessioni, dopo il primo turno si invia solo la nuova query (e i nuovi file)
+        in coda allo storico: il prefisso con il catalogo resta identico e il backend
+        può riusarne la cache invece di rielaborarlo.
+        """
+        history = session.history if session is not None else None
+        if history:
+            prompt = self.build_followup_prompt(query, input_files)
+        else:
+            prompt = self.build_prompt(discovered_services, discovered_capabilities, discovered_endpoints, query, input_files)
+
+        response, plan_latency = self.query_ollama(prompt, history)
+        print(f"[LLM RESPONSE] {response}")
+        print("="*100)
 
-            latency = end_time - start_time
-            data = response.json()
-            content = data["choices"][0]["message"]["content"]
+        if session is not None:
+            session.remember(prompt, response, self.sessions.max_turns)
+        return response, plan_latency
 
-            return content.strip(), latency
+    def build_followup_prompt(self, query, input_files=None):
+        return f"""
+            <|user|>
+            FOLLOW-UP QUERY. Use the same SERVICES, CAPABILITIES, ENDPOINTS, FILES and RULES as before.
+            Files uploaded earlier in this conversation are still available.
+            REPLY ONLY with a new valid JSON execution plan for this query.
 
-        except requests.exceptions.RequestException as e:
-            raise RuntimeError(f"[HTTP ERROR] Errore nella richiesta a Ollama: {e}")
-        except ValueError:
-            raise RuntimeError(f"[PARSE ERROR] Risposta non JSON valida da Ollama: {response.text}")
+            NEW FILES:
+            {input_files}
 
+            QUERY:
+            {query}
+            <|end|>
+            <|assistant|>
+        """
 
-    def decompose_task(self, discovered_services, discovered_capabilities, discovered_endpoints, query, input_files=None):
+    def build_prompt(self, discovered_services, discovered_capabilities, discovered_endpoints, query, input_files=None):
 
         example = {
         "tasks": [
@@ -156,11 +267,7 @@ class Controller:
             <|end|>
             <|assistant|>
         """
-
-        response, plan_latency = self.query_ollama(prompt)
-        print(f"[LLM RESPONSE] {response}")
-        print("="*100)
-        return response, plan_latency
+        return prompt
 
     def extract_agents(self, agents_json):
         plan = {}
@@ -186,7 +293,7 @@ class Controller:
 
 
     # ========== Async version maintained for future works ==========
-    async def call_agent(self, session, task, discovered_services):
+    async def call_agent(self, session, task, discovered_services, context=None):
         """Versione asincrona - mantenuta per compatibilità"""
         task_name = task.get("task_name")
         endpoint = task.get("endpoint")
@@ -215,7 +322,7 @@ class Controller:
 
             elif tag == "FILE":
                 filename = content
-                file_path = os.path.join("Files", filename)
+                file_path = os.path.join(self.files_dir(context), filename)
 
                 if not os.path.exists(file_path):
                     response_result.update({
@@ -291,17 +398,78 @@ class Controller:
 
         return response_result
 
-    async def trigger_agents_async(self, agents: dict, discovered_services):
+    async def trigger_agents_async(self, agents: dict, discovered_services, context=None):
         """Versione asincrona - mantenuta per compatibilità"""
         tasks = agents.get("tasks", [])
         async with aiohttp.ClientSession() as session:
-            futures = [asyncio.create_task(self.call_agent(session, task, discovered_services)) for task in tasks]
+            futures = [asyncio.create_task(self.call_agent(session, task, discovered_services, context)) for task in tasks]
             results = await asyncio.gather(*futures)
         return results
     
     # ===============================================================
 
-    def call_agent_sync(self, task, discovered_services):
+    def send_request(self, operation, url, is_file=False, file_path=None, filename=None, payload=None, stream=False):
+        if is_file:
+            # Upload file
+            with open(file_path, "rb") as file:
+                files = {"file": (filename, file, "application/octet-stream")}
+                match operation:
+                    case "POST":
+                        resp = self.http.post(url, files=files, timeout=3600, stream=stream)
+                    case "PUT":
+                        resp = self.http.put(url, files=files, timeout=3600, stream=stream)
+                    case _:
+                        raise ValueError(f"Operazione HTTP non supportata per file: {operation}")
+        else:
+            # Wrappa il payload in {"input": ...} se è una stringa
+            if isinstance(payload, str):
+                json_payload = {"input": payload}
+            else:
+                json_payload = payload
+
+            match operation:
+                case "POST":
+                    resp = self.http.post(url, json=json_payload, timeout=3600, stream=stream)
+                case "PUT":
+                    resp = self.http.put(url, json=json_payload, timeout=3600, stream=stream)
+                case "GET":
+                    resp = self.http.get(url, timeout=3600, stream=stream)
+                case "DELETE":
+                    resp = self.http.delete(url, timeout=3600, stream=stream)
+                case _:
+                    raise ValueError(f"Operazione HTTP non supportata: {operation}")
+        return resp
+
+    def send_balanced(self, task, operation, endpoint, is_file=False, file_path=None, filename=None, payload=None, stream=False):
+        """
+        Invia la richiesta a una delle istanze healthy del servizio della task.
+        Le operazioni idempotenti che falliscono (errore di rete o 5xx) vengono
+        ritentate su un'altra istanza.
+        """
+        tried = set()
+        attempt = 0
+        while True:
+            instance = self.balancer.pick(task.get("service_id"), exclude=tried)
+            url = LoadBalancer.rewrite(endpoint, instance)
+            try:
+                with self.balancer.track(instance):
+                    resp = self.send_request(operation, url, is_file, file_path, filename, payload, stream)
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
+                if instance is None or not self.balancer.can_retry(operation, attempt):
+                    raise
+                resp = None
+
+            if resp is not None and (resp.status_code < 500 or instance is None or not self.balancer.can_retry(operation, attempt)):
+                return resp
+
+            if resp is not None:
+                resp.close()
+            metrics.incr("lb_retries_total")
+            print(f"[BALANCER] Retrying '{task.get('task_name')}' on another instance than {url}")
+            tried.add(LoadBalancer.instance_key(instance))
+            attempt += 1
+
+    def call_agent_sync(self, task, discovered_services, context=None):
         """Versione sincrona - esegue una singola task"""
         task_name = task.get("task_name")
         endpoint = task.get("endpoint")
@@ -330,7 +498,7 @@ class Controller:
 
             elif tag == "FILE":
                 filename = content
-                file_path = os.path.join("Files", filename)
+                file_path = os.path.join(self.files_dir(context), filename)
 
                 if not os.path.exists(file_path):
                     response_result.update({
@@ -345,35 +513,9 @@ class Controller:
             payload = input_data
 
         try:
-            if is_file:
-                # Upload file
-                with open(file_path, "rb") as file:
-                    files = {"file": (filename, file, "application/octet-stream")}
-                    match operation:
-                        case "POST":
-                            resp = requests.post(endpoint, files=files, timeout=3600)
-                        case "PUT":
-                            resp = requests.put(endpoint, files=files, timeout=3600)
-                        case _:
-                            raise ValueError(f"Operazione HTTP non supportata per file: {operation}")
-            else:
-                # Wrappa il payload in {"input": ...} se è una stringa
-                if isinstance(payload, str):
-                    json_payload = {"input": payload}
-                else:
-                    json_payload = payload
-
-                match operation:
-                    case "POST":
-                        resp = requests.post(endpoint, json=json_payload, timeout=3600)
-                    case "PUT":
-                        resp = requests.put(endpoint, json=json_payload, timeout=3600)
-                    case "GET":
-                        resp = requests.get(endpoint, timeout=3600)
-                    case "DELETE":
-                        resp = requests.delete(endpoint, timeout=3600)
-                    case _:
-                        raise ValueError(f"Operazione HTTP non supportata: {operation}")
+            start_time = time.perf_counter()
+            stream = context is not None and context.stream_files
+            resp = self.send_balanced(task, operation, endpoint, is_file, file_path, filename, payload, stream)
 
             status = resp.status_code
             content_type = resp.headers.get("Content-Type", "")
@@ -382,7 +524,7 @@ class Controller:
 
                 # ===== FILE =====
                 if content_type.startswith("application/pdf"):
-                    return {
+                    file_result = {
                         "status": "FILE",
                         "status_code": status,
                         "headers": {
@@ -391,9 +533,15 @@ class Controller:
                                 "Content-Disposition",
                                 'attachment; filename="output.pdf"'
                             )
-                        },
-                        "body": resp.content
+                        }
                     }
+                    if stream:
+                        # Il corpo viene letto solo quando la risposta al client lo inoltra
+                        file_result["stream"] = resp
+                    else:
+                        file_result["body"] = resp.content
+                    self.latency_model.record(operation, endpoint, time.perf_counter() - start_time)
+                    return file_result
 
                 # ===== JSON =====
                 if "application/json" in content_type:
@@ -420,6 +568,8 @@ class Controller:
                     "result": error_text
                 })
 
+            self.latency_model.record(operation, endpoint, time.perf_counter() - start_time)
+
         except Exception as e:
             print(f"[EXCEPTION] Task '{task_name}' → {e}")
             response_result.update({
@@ -430,56 +580,187 @@ class Controller:
 
         return response_result
     
-    def trigger_agents_sync(self, agents: dict, discovered_services):
-        tasks = agents.get("tasks", [])
-        results = []
+    def trigger_agents_sync(self, agents: dict, discovered_services, context=None):
+        """
+        Esegue le task del piano con al più `max_concurrency` chiamate in parallelo,
+        avviando per prime quelle sul cammino critico secondo il modello di latenza.
 
-        for task in tasks:
-            result = self.call_agent_sync(task, discovered_services)
+        Il primo FILE chiude l'esecuzione. Le task che nel piano seguono un endpoint
+        noto per restituire file restano in coda finché quella task non termina, così
+        non vengono eseguite task il cui risultato andrebbe scartato.
+        """
+        tasks = agents.get("tasks", [])
+        schedule = PlanSchedule(tasks, self.latency_model)
+        results = [None] * len(tasks)
+        file_result = None
+        file_keys = [
+            LatencyModel.key(t.get("operation", ""), t.get("endpoint", "")) for t in tasks
+        ]
+        pending_file_tasks = [i for i, key in enumerate(file_keys) if key in self.file_endpoints]
+
+        ready = [schedule.sort_key(i) for i in schedule.initial_ready()]
+        heapq.heapify(ready)
+        running = {}
+
+        while ready or running:
+            held = []
+            while ready and file_result is None and len(running) < self.max_concurrency:
+                entry = heapq.heappop(ready)
+                i = entry[2]
+                if pending_file_tasks and i > pending_file_tasks[0]:
+                    held.append(entry)
+                    continue
+                future = self.executor.submit(self.call_agent_sync, tasks[i], discovered_services, context)
+                running[future] = i
+            for entry in held:
+                heapq.heappush(ready, entry)
+
+            if not running:
+                break
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                i = running.pop(future)
+                result = future.result()
+                if i in pending_file_tasks:
+                    pending_file_tasks.remove(i)
+
+                if isinstance(result, dict) and result.get("status") == "FILE":
+                    self.file_endpoints.add(file_keys[i])
+                    if file_result is None:
+                        file_result = result
+                    elif "stream" in result:
+                        result["stream"].close()
+                    continue
+
+                results[i] = result
+                nxt = schedule.successor[i]
+                if nxt is not None:
+                    heapq.heappush(ready, schedule.sort_key(nxt))
+
+        if file_result is not None:
+            return file_result
+
+        return [r for r in results if r is not None]
+
+    @staticmethod
+    def iter_file(result, chunk_size=64 * 1024):
+        """Corpo di un risultato FILE: i byte già letti oppure lo stream ancora aperto verso l'agente."""
+        if "stream" not in result:
+            yield result["body"]
+            return
+        resp = result["stream"]
+        try:
+            for chunk in resp.iter_content(chunk_size):
+                if chunk:
+                    yield chunk
+        finally:
+            resp.close()
 
-            if isinstance(result, dict) and result.get("status") == "FILE":
-                return result
+    def estimate_plan_latency(self, plan):
+        tasks = plan.get("tasks", []) if isinstance(plan, dict) else []
+        return PlanSchedule(tasks, self.latency_model).estimate(self.max_concurrency)
 
-            results.append(result)
+    def trigger_agents(self, agents: dict, discovered_services, context=None):
+        """Wrapper - usa la versione sincrona"""
+        return self.trigger_agents_sync(agents, discovered_services, context)
 
-        return results
+    def cleanup(self, context):
+        if not os.path.isdir(context.files_dir):
+            return
+        try:
+            shutil.rmtree(context.files_dir)
+        except Exception as e:
+            print('Failed to delete %s. Reason: %s' % (context.files_dir, e))
 
+    def control(self, query, files=None, context=None):
+        context = context or self.new_context()
+        session = context.session
+        if session is None:
+            try:
+                return self._control(query, files, context)
+            finally:
+                self.cleanup(context)
 
-    def trigger_agents(self, agents: dict, discovered_services):
-        """Wrapper - usa la versione sincrona"""
-        return self.trigger_agents_sync(agents, discovered_services)
+        # Le query di una stessa sessione vengono servite una alla volta
+        with session.lock:
+            try:
+                return self._control(query, files, context)
+            finally:
+                self.sessions.account(session)
 
-    def control(self, query, files=None):
+    def _control(self, query, files, context):
         input_files = files or []
-        analyzed_files = self.analyze_files(input_files)
+        analyzed_files = self.analyze_files(input_files, context)
+
+        matched = self.workflows.match(query, analyzed_files)
+        if matched is not None:
+            workflow, values = matched
+            print(f"[WORKFLOW] Query matched workflow '{workflow['name']}' v{workflow['version']}, skipping planning")
+            plan = self.workflows.instantiate(workflow, values)
+            context.workflow = plan["workflow"]
+            return self.execute_plan(plan, [], 0.0, context)
+
+        session = context.session
+        if session is not None and session.discovered is not None and not context.refresh and self.services_alive(session.discovered):
+            discovered = session.discovered
+            print("[SESSION] Reusing discovered services")
+        else:
+            discovered, error = self.discover(query)
+            if error is not None:
+                return {
+                    "execution_plan": {},
+                    "execution_results": [],
+                    "error": error
+                }
+            if session is not None:
+                session.discovered = discovered
+                session.forget_plan()
 
-        catalog_url = os.environ.get("CATALOG_URL")
-        registry = Discovery(os.environ.get("REGISTRY_URL"))
+        plan_json, plan_latency = self.decompose_task(
+            discovered_services=discovered["services"],
+            discovered_capabilities=discovered["capabilities"],
+            discovered_endpoints=discovered["endpoints"],
+            query=query,
+            input_files=analyzed_files,
+            session=session
+        )
+        plan = self.extract_agents(plan_json)
+        return self.execute_plan(plan, discovered["services"], plan_latency, context)
+
+    def services_alive(self, discovered):
+        registry_service_ids = set(s["id"] for s in self.registry.services_cached())
+        return all(s["_id"] in registry_service_ids for s in discovered["services"])
 
+    def discover(self, query):
         discovered_services = []
         discovered_capabilities = []
         discovered_endpoints = []
 
-        services = registry.services()
+        services = self.registry.services()
 
         register_key = "POST /register"
         print("DISCOVERED SERVICES:")
 
+        # Il catalogo può usare come chiave il meta service_doc_id, condiviso tra le repliche
+        registry_service_ids = {s["id"] for s in services} | {s["catalog_id"] for s in services if s["catalog_id"]}
+
+        # La ricerca viene ristretta ai servizi registrati: tutti i candidati sono raggiungibili
         input = {
-            "query": query
+            "query": query,
+            "service_ids": sorted(registry_service_ids)
         }
-        service_data = requests.post(f"{catalog_url}/index/search", json=input)
+        if self.search_k:
+            input["k"] = self.search_k
+        if self.search_max_tokens:
+            input["max_tokens"] = self.search_max_tokens
+        service_data = self.http.post(f"{self.catalog_url}/index/search", json=input)
         service_data = service_data.json()
         service_list = service_data["results"]
 
         if not service_list:
-            return {
-                "execution_plan": {},
-                "execution_results": [],
-                "error": "No services matched the query"
-            }
+            return None, "No services matched the query"
         
-        registry_service_ids = set(s["id"] for s in services)
         filtered_service_list = [s for s in service_list if s["_id"] in registry_service_ids]
         orphaned_services = [s for s in service_list if s["_id"] not in registry_service_ids]
         if orphaned_services:
@@ -488,11 +769,7 @@ class Controller:
                 print(f"- {s.get('_id')} : {s.get('name')}")
 
         if not filtered_service_list:
-            return {
-                "execution_plan": {},
-                "execution_results": [],
-                "error": "None of the discovered services are currently available in the registry"
-            }
+            return None, "None of the discovered services are currently available in the registry"
         
         for service in filtered_service_list:
             if isinstance(service.get("capabilities"), dict):
@@ -512,40 +789,34 @@ class Controller:
             discovered_services.append(service_preamble)
             discovered_capabilities.append(service.get("capabilities", {}))
             discovered_endpoints.append(service.get("endpoints", {}))
-        
-        plan_json, plan_latency = self.decompose_task(
-            discovered_services=discovered_services,
-            discovered_capabilities=discovered_capabilities,
-            discovered_endpoints=discovered_endpoints,
-            query=query,
-            input_files=analyzed_files
-        )
-        plan = self.extract_agents(plan_json)
 
-        results = self.trigger_agents(plan, discovered_services)
+        discovered = {
+            "services": discovered_services,
+            "capabilities": discovered_capabilities,
+            "endpoints": discovered_endpoints
+        }
+        return discovered, None
+
+    def execute_plan(self, plan, discovered_services, plan_latency, context):
+        context.estimated_latency = self.estimate_plan_latency(plan)
 
-        self.execution_plan = plan
-        self.execution_results = results
+        results = self.trigger_agents(plan, discovered_services, context)
+
+        context.execution_plan = plan
+        context.execution_results = results
+        context.plan_latency = plan_latency
 
         if isinstance(results, dict) and results.get("status") == "FILE":
             return Response(
-                results["body"],
+                self.iter_file(results),
                 status=results["status_code"],
                 headers=results["headers"]
             )
 
-        for filename in os.listdir('Files'):
-            file_path = os.path.join('Files', filename)
-            try:
-                if os.path.isfile(file_path) or os.path.islink(file_path):
-                    os.unlink(file_path)
-                elif os.path.isdir(file_path):
-                    shutil.rmtree(file_path)
-            except Exception as e:
-                print('Failed to delete %s. Reason: %s' % (file_path, e))
-
         return {
             "execution_plan": plan,
             "execution_results": results,
-            "plan_generation_latency": plan_latency
+            "plan_generation_latency": plan_latency,
+            "estimated_latency": context.estimated_latency,
+            "workflow": context.workflow
         }
\ No newline at end of file
@@ -1,5 +1,8 @@
 import requests
+import threading
 import json
+import time
+import os
 
 class Discovery:
     _instance = None
@@ -16,9 +19,13 @@ class Discovery:
         Inizializza la classe con i dati di connessione.
         """
         self.registry_address = address
+        self.http = requests.Session()
+        self.cache_ttl = float(os.environ.get("DISCOVERY_CACHE_TTL", 5))
+        self._cache = {}
+        self._cache_lock = threading.Lock()
 
     def services(self):
-        response = requests.get(f"{self.registry_address}/v1/agent/services")
+        response = self.http.get(f"{self.registry_address}/v1/agent/services")
         services_data = response.json()
 
         services_list = []
@@ -34,3 +41,60 @@ class Discovery:
             services_list.append(service)
 
         return services_list
+
+    def services_cached(self):
+        return self._cached("services", self.services)
+
+    def _cached(self, key, loader):
+        now = time.monotonic()
+        with self._cache_lock:
+            entry = self._cache.get(key)
+            if entry is not None and now - entry[0] < self.cache_ttl:
+                return entry[1]
+        value = loader()
+        with self._cache_lock:
+            self._cache[key] = (now, value)
+        return value
+
+    def healthy_instances(self, service_id):
+        """
+        Istanze con health check passing del servizio di catalogo `service_id`
+        (stesso ID Consul o stesso Meta.service_doc_id), con una cache di `cache_ttl` secondi.
+        """
+        services = self.services_cached()
+        names = {s["service"] for s in services if s["id"] == service_id or s["catalog_id"] == service_id}
+
+        instances = []
+        for name in names:
+            entries = self._cached(f"health:{name}", lambda: self._passing(name))
+            for entry in entries:
+                if entry["id"] == service_id or entry["catalog_id"] == service_id:
+                    instances.append(entry)
+        return instances
+
+    def _passing(self, name):
+        response = self.http.get(
+            f"{self.registry_address}/v1/health/service/{name}",
+            params={"passing": "true"}
+        )
+        response.raise_for_status()
+
+        entries = []
+        for item in response.json():
+            node = item.get("Node", {})
+            service = item.get("Service", {})
+            meta = service.get("Meta") or {}
+            address = service.get("Address") or node.get("Address")
+            port = service.get("Port")
+            if not address or not port:
+                continue
+            entries.append({
+                "id": service.get("ID"),
+                "catalog_id": meta.get("service_doc_id", {}),
+                "address": address,
+                "port": port,
+                "node": node.get("Node"),
+                "datacenter": node.get("Datacenter"),
+                "zone": meta.get("zone")
+            })
+        return entries
@@ -0,0 +1,170 @@
+from collections import deque
+from urllib.parse import urlsplit
+import threading
+import heapq
+import json
+import time
+import os
+
+class LatencyModel:
+    """
+    Modello di latenza per endpoint (EWMA e p95 su una finestra mobile),
+    alimentato dai tempi di call_agent_sync e salvato su disco tra un riavvio e l'altro.
+
+    LATENCY_MODEL_PATH deve puntare a un volume montato: nel filesystem del container
+    il file andrebbe perso a ogni ricreazione. L'ultimo salvataggio forzato avviene
+    allo spegnimento (app.py).
+    """
+
+    def __init__(self, path=None):
+        self.path = path or os.environ.get("LATENCY_MODEL_PATH", "latency_model.json")
+        self.alpha = float(os.environ.get("LATENCY_EWMA_ALPHA", 0.3))
+        self.window = int(os.environ.get("LATENCY_WINDOW", 200))
+        self.default_latency = float(os.environ.get("LATENCY_DEFAULT", 1.0))
+        self.persist_interval = float(os.environ.get("LATENCY_PERSIST_INTERVAL", 30))
+
+        self._lock = threading.Lock()
+        self._persist_lock = threading.Lock()
+        self._stats = {}
+        self._dirty = False
+        self._last_persist = time.monotonic()
+        self.load()
+
+    @staticmethod
+    def key(operation, endpoint):
+        parts = urlsplit(endpoint or "")
+        return f"{(operation or '').upper()} {parts.scheme}://{parts.netloc}{parts.path}"
+
+    def record(self, operation, endpoint, seconds):
+        key = self.key(operation, endpoint)
+        with self._lock:
+            stats = self._stats.get(key)
+            if stats is None:
+                stats = {"ewma": seconds, "samples": deque(maxlen=self.window)}
+                self._stats[key] = stats
+            else:
+                stats["ewma"] = self.alpha * seconds + (1 - self.alpha) * stats["ewma"]
+            stats["samples"].append(seconds)
+            self._dirty = True
+        self.persist()
+
+    def _p95(self, samples):
+        ordered = sorted(samples)
+        return ordered[int(0.95 * (len(ordered) - 1))]
+
+    def predict(self, operation, endpoint):
+        with self._lock:
+            stats = self._stats.get(self.key(operation, endpoint))
+            if stats is None:
+                return self.default_latency
+            return stats["ewma"]
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                key: {
+                    "ewma": stats["ewma"],
+                    "p95": self._p95(stats["samples"]),
+                    "samples": len(stats["samples"])
+                }
+                for key, stats in self._stats.items() if stats["samples"]
+            }
+
+    def load(self):
+        if not self.path or not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            with self._lock:
+                for key, stats in data.items():
+                    self._stats[key] = {
+                        "ewma": float(stats["ewma"]),
+                        "samples": deque(stats.get("samples", []), maxlen=self.window)
+                    }
+        except Exception as e:
+            print(f"[LATENCY MODEL] Failed to load {self.path}: {e}")
+
+    def persist(self, force=False):
+        if not self.path:
+            return
+        with self._lock:
+            due = time.monotonic() - self._last_persist >= self.persist_interval
+            if not self._dirty or not (force or due):
+                return
+            data = {
+                key: {"ewma": stats["ewma"], "samples": list(stats["samples"])}
+                for key, stats in self._stats.items()
+            }
+            self._dirty = False
+            self._last_persist = time.monotonic()
+
+        with self._persist_lock:
+            tmp_path = f"{self.path}.tmp"
+            try:
+                with open(tmp_path, "w", encoding="utf-8") as f:
+                    json.dump(data, f)
+                os.replace(tmp_path, self.path)
+            except Exception as e:
+                print(f"[LATENCY MODEL] Failed to persist {self.path}: {e}")
+
+
+class PlanSchedule:
+    """
+    Ordinamento delle task di un piano.
+
+    Le task dirette allo stesso servizio restano nell'ordine del piano (es. upload
+    del documento e poi domanda), quelle su servizi diversi sono indipendenti.
+    La priorità di ogni task è la lunghezza prevista della catena che parte da
+    essa: prima il cammino critico, a parità la task più lunga.
+    """
+
+    def __init__(self, tasks, latency_model):
+        self.tasks = tasks
+        self.durations = [
+            latency_model.predict(t.get("operation", ""), t.get("endpoint", "")) for t in tasks
+        ]
+        self.successor = [None] * len(tasks)
+        self.has_predecessor = [False] * len(tasks)
+
+        last_in_chain = {}
+        for i, task in enumerate(tasks):
+            chain = self.chain_key(task)
+            if chain in last_in_chain:
+                prev = last_in_chain[chain]
+                self.successor[prev] = i
+                self.has_predecessor[i] = True
+            last_in_chain[chain] = i
+
+        self.priority = [0.0] * len(tasks)
+        for i in reversed(range(len(tasks))):
+            nxt = self.successor[i]
+            self.priority[i] = self.durations[i] + (self.priority[nxt] if nxt is not None else 0.0)
+
+    @staticmethod
+    def chain_key(task):
+        return task.get("service_id") or urlsplit(task.get("endpoint") or "").netloc
+
+    def sort_key(self, i):
+        return (-self.priority[i], -self.durations[i], i)
+
+    def initial_ready(self):
+        return [i for i in range(len(self.tasks)) if not self.has_predecessor[i]]
+
+    def estimate(self, concurrency):
+        """Simula il list scheduling con `concurrency` slot e ritorna il makespan previsto."""
+        ready = [self.sort_key(i) for i in self.initial_ready()]
+        heapq.heapify(ready)
+        running = []
+        now = 0.0
+
+        while ready or running:
+            while ready and len(running) < max(1, concurrency):
+                _, _, i = heapq.heappop(ready)
+                heapq.heappush(running, (now + self.durations[i], i))
+            now, i = heapq.heappop(running)
+            nxt = self.successor[i]
+            if nxt is not None:
+                heapq.heappush(ready, self.sort_key(nxt))
+
+        return now
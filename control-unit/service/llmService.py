@@ -0,0 +1,188 @@
+from service.metricsService import metrics
+import requests
+import threading
+import time
+import os
+
+class LLMClient:
+    """
+    Client condiviso verso il backend LLM (Ollama).
+
+    All'avvio precarica i modelli configurati e poi invia periodicamente dei
+    ping di keep-alive, in modo che la prima pianificazione dopo un periodo di
+    inattività non paghi il caricamento del modello in memoria.
+    """
+
+    def __init__(self, url=None, models=None, keep_alive=None):
+        self.url = url or os.environ.get("OLLAMA_API_URL", "http://localhost:11434")
+        self.models = models or [
+            m.strip() for m in os.environ.get("OLLAMA_PREWARM_MODELS", "phi4-reasoning:14b").split(",") if m.strip()
+        ]
+        self.keep_alive = keep_alive or os.environ.get("OLLAMA_KEEP_ALIVE", "30m")
+        self.prewarm_enabled = os.environ.get("OLLAMA_PREWARM", "1") != "0"
+        self.keepalive_interval = float(os.environ.get("OLLAMA_KEEPALIVE_INTERVAL", 240))
+        self.cold_start_threshold = float(os.environ.get("OLLAMA_COLD_START_THRESHOLD", 1.0))
+        self.prewarm_retry_delay = float(os.environ.get("OLLAMA_PREWARM_RETRY_DELAY", 5))
+
+        self.session = requests.Session()
+        self._native_chat = True
+        self._ready = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def is_ready(self):
+        return self._ready.is_set()
+
+    def start(self):
+        """Avvia in background prewarm e keep-alive. La readiness resta False fino a prewarm concluso."""
+        if self._thread is not None:
+            return
+        if not self.prewarm_enabled:
+            self._ready.set()
+            return
+        self._thread = threading.Thread(target=self._run, name="llm-keepalive", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        self.prewarm()
+        if self.keepalive_interval <= 0:
+            return
+        while not self._stop.wait(self.keepalive_interval):
+            for model in self.models:
+                try:
+                    self.ping(model)
+                except Exception as e:
+                    print(f"[KEEPALIVE ERROR] Model '{model}': {e}")
+
+    def prewarm(self):
+        pending = list(self.models)
+        while pending and not self._stop.is_set():
+            model = pending[0]
+            try:
+                self.ping(model)
+                print(f"[PREWARM] Model '{model}' loaded")
+                pending.pop(0)
+            except requests.exceptions.HTTPError as e:
+                if self._route_missing(e.response):
+                    print(f"[PREWARM] Backend does not support /api/generate for '{model}', skipping")
+                    pending.pop(0)
+                elif e.response is not None and e.response.status_code == 404:
+                    # Modello non ancora scaricato: il servizio resta non pronto finché non compare
+                    print(f"[PREWARM ERROR] Model '{model}' not available: {e.response.text}")
+                    self._stop.wait(self.prewarm_retry_delay)
+                else:
+                    print(f"[PREWARM ERROR] Model '{model}': {e}")
+                    self._stop.wait(self.prewarm_retry_delay)
+            except requests.exceptions.RequestException as e:
+                print(f"[PREWARM ERROR] Model '{model}': {e}")
+                self._stop.wait(self.prewarm_retry_delay)
+        self._ready.set()
+
+    def ping(self, model):
+        """Richiesta vuota a /api/generate: carica il modello (se necessario) e rinnova il keep_alive."""
+        response = self.session.post(
+            f"{self.url}/api/generate",
+            json={
+                "model": model,
+                "prompt": "",
+                "keep_alive": self.keep_alive,
+                "stream": False
+            },
+            timeout=3600
+        )
+        response.raise_for_status()
+        metrics.incr("llm_keepalive_pings_total")
+        self._record_load(response.json(), model)
+
+    @staticmethod
+    def _route_missing(response):
+        """
+        Un 404 di Ollama con corpo {"error": ...} indica un modello non scaricato;
+        solo un 404 senza quel corpo indica un endpoint non esposto dal backend.
+        """
+        if response is None or response.status_code != 404:
+            return False
+        try:
+            data = response.json()
+        except ValueError:
+            return True
+        return not (isinstance(data, dict) and "error" in data)
+
+    def _record_load(self, data, model):
+        if not isinstance(data, dict) or "load_duration" not in data:
+            return
+        load_seconds = data["load_duration"] / 1e9
+        metrics.observe("llm_load_seconds", load_seconds)
+        if load_seconds >= self.cold_start_threshold:
+            metrics.incr("llm_cold_starts_total")
+            print(f"[COLD START] Model '{model}' loaded in {load_seconds:.2f}s")
+
+    def chat(self, prompt: str, model=None, history=None):
+        """
+        Usa l'API nativa /api/chat, che accetta keep_alive e restituisce load_duration.
+        Se il backend non la espone (404) ripiega su /v1/chat/completions.
+        """
+        model = model or (self.models[0] if self.models else None)
+        messages = [
+            {
+                "role": "system",
+                "content": ""
+            },
+            *(history or []),
+            {
+                "role": "user",
+                "content": prompt
+            }
+        ]
+        response = None
+        try:
+            start_time = time.perf_counter()
+            if self._native_chat:
+                response = self.session.post(
+                    f"{self.url}/api/chat",
+                    json={
+                        "model": model,
+                        "messages": messages,
+                        "stream": False,
+                        "keep_alive": self.keep_alive,
+                        "options": {
+                            "temperature": 0,
+                            "num_predict": 4096
+                        }
+                    }
+                )
+                if self._route_missing(response):
+                    print("[LLM] Backend does not support /api/chat, falling back to /v1/chat/completions")
+                    self._native_chat = False
+            if not self._native_chat:
+                response = self.session.post(
+                    f"{self.url}/v1/chat/completions",
+                    json={
+                        "model": model,
+                        "messages": messages,
+                        "keep_alive": self.keep_alive,
+                        "temperature": 0,
+                        "max_tokens": 4096
+                    }
+                )
+            response.raise_for_status()
+            end_time = time.perf_counter()
+
+            latency = end_time - start_time
+            metrics.observe("llm_request_seconds", latency)
+            data = response.json()
+            self._record_load(data, model)
+            if self._native_chat:
+                content = data["message"]["content"]
+            else:
+                content = data["choices"][0]["message"]["content"]
+
+            return content.strip(), latency
+
+        except requests.exceptions.RequestException as e:
+            raise RuntimeError(f"[HTTP ERROR] Errore nella richiesta a Ollama: {e}")
+        except ValueError:
+            raise RuntimeError(f"[PARSE ERROR] Risposta non JSON valida da Ollama: {response.text}")
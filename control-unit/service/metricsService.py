@@ -0,0 +1,42 @@
+import threading
+
+class Metrics:
+    """
+    Registro in-process di contatori, gauge e riepiloghi (count/sum/max),
+    condiviso tra i thread di cheroot ed esposto da /api/control/metrics.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._gauges = {}
+        self._summaries = {}
+
+    def incr(self, name, value=1):
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + value
+
+    def set(self, name, value):
+        with self._lock:
+            self._gauges[name] = value
+
+    def observe(self, name, value):
+        with self._lock:
+            summary = self._summaries.setdefault(name, {"count": 0, "sum": 0.0, "max": 0.0})
+            summary["count"] += 1
+            summary["sum"] += value
+            summary["max"] = max(summary["max"], value)
+
+    def snapshot(self):
+        with self._lock:
+            summaries = {}
+            for name, s in self._summaries.items():
+                summaries[name] = dict(s, avg=s["sum"] / s["count"] if s["count"] else 0.0)
+            return {
+                "counters": dict(self._counters),
+                "gauges": dict(self._gauges),
+                "summaries": summaries
+            }
+
+
+metrics = Metrics()
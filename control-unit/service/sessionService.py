@@ -0,0 +1,125 @@
+from service.metricsService import metrics
+from collections import OrderedDict
+import threading
+import shutil
+import json
+import time
+import uuid
+import re
+import os
+
+SESSION_ID_PATTERN = re.compile(r"^[A-Za-z0-9_-]{1,64}$")
+
+class Session:
+    """
+    Stato conservato tra le query di una conversazione: servizi scoperti,
+    file caricati (per digest) e storico dei turni inviati al planner.
+    """
+
+    def __init__(self, session_id, files_dir):
+        self.id = session_id
+        self.files_dir = files_dir
+        self.lock = threading.Lock()
+        self.discovered = None
+        self.files = {}
+        self.history = []
+        self.created_at = time.time()
+        self.last_used = time.monotonic()
+
+    def remember(self, prompt, response, max_turns):
+        answer = re.split(r"</think>", response, flags=re.IGNORECASE)[-1].strip()
+        self.history.extend([
+            {"role": "user", "content": prompt},
+            {"role": "assistant", "content": answer}
+        ])
+        if len(self.history) > 2 * max_turns:
+            # Si riparte con un prompt completo al prossimo turno
+            self.history = []
+
+    def forget_plan(self):
+        self.history = []
+
+    def size_bytes(self):
+        size = sum(len(m["content"]) for m in self.history)
+        if self.discovered is not None:
+            size += len(json.dumps(self.discovered))
+        size += sum(f["bytes"] for f in self.files.values())
+        return size
+
+
+class SessionStore:
+    """Sessioni in memoria con eviction LRU, TTL e limite complessivo di memoria."""
+
+    def __init__(self, files_root="Files"):
+        self.root = os.path.join(files_root, "sessions")
+        self.ttl = float(os.environ.get("SESSION_TTL", 1800))
+        self.max_sessions = int(os.environ.get("SESSION_MAX", 256))
+        self.max_bytes = int(os.environ.get("SESSION_MAX_BYTES", 256 * 1024 * 1024))
+        self.max_turns = int(os.environ.get("SESSION_MAX_TURNS", 4))
+
+        self._lock = threading.Lock()
+        self._sessions = OrderedDict()
+        self._sizes = {}
+        shutil.rmtree(self.root, ignore_errors=True)
+
+    def get_or_create(self, session_id=None):
+        if session_id is not None and not SESSION_ID_PATTERN.match(session_id):
+            raise ValueError("Invalid session id")
+        session_id = session_id or uuid.uuid4().hex
+
+        with self._lock:
+            self._expire()
+            session = self._sessions.get(session_id)
+            if session is not None:
+                self._sessions.move_to_end(session_id)
+                session.last_used = time.monotonic()
+                metrics.incr("session_followups_total")
+                return session
+
+            session = Session(session_id, os.path.join(self.root, session_id))
+            self._sessions[session_id] = session
+            self._sizes[session_id] = 0
+            metrics.incr("sessions_created_total")
+            self._enforce_limits(keep=session_id)
+            return session
+
+    def account(self, session):
+        """Aggiorna la dimensione stimata della sessione e applica i limiti."""
+        with self._lock:
+            if session.id not in self._sessions:
+                return
+            self._sizes[session.id] = session.size_bytes()
+            self._enforce_limits(keep=session.id)
+
+    def delete(self, session_id):
+        with self._lock:
+            return self._drop(session_id)
+
+    def _drop(self, session_id):
+        session = self._sessions.pop(session_id, None)
+        self._sizes.pop(session_id, None)
+        if session is None:
+            return False
+        shutil.rmtree(session.files_dir, ignore_errors=True)
+        return True
+
+    def _expire(self):
+        now = time.monotonic()
+        expired = [
+            sid for sid, s in self._sessions.items() if now - s.last_used > self.ttl and not s.lock.locked()
+        ]
+        for sid in expired:
+            self._drop(sid)
+            metrics.incr("session_evictions_total")
+
+    def _enforce_limits(self, keep=None):
+        for sid in list(self._sessions):
+            if len(self._sessions) <= self.max_sessions and sum(self._sizes.values()) <= self.max_bytes:
+                break
+            # Le sessioni con una richiesta in corso non vengono rimosse
+            if sid == keep or self._sessions[sid].lock.locked():
+                continue
+            self._drop(sid)
+            metrics.incr("session_evictions_total")
+        metrics.set("sessions_active", len(self._sessions))
+        metrics.set("sessions_bytes", sum(self._sizes.values()))
@@ -0,0 +1,253 @@
+from urllib.parse import quote
+import threading
+import json
+import time
+import re
+import os
+
+SLOT_PATTERN = re.compile(r"\{(\w+)\}")
+
+class WorkflowRegistry:
+    """
+    Registro persistente e versionato di workflow parametrici.
+
+    Un workflow è una lista di task (stesso formato del piano prodotto dall'LLM)
+    in cui endpoint e input possono contenere degli slot `{nome}`. Le regole di
+    `match` (regex con gruppi nominati, keyword, categorie dei file caricati)
+    permettono di istanziarlo direttamente da una query, senza catalogo né LLM.
+
+    Esempio:
+        {
+            "name": "qa-upload-ask",
+            "description": "Upload a PDF to the QA service, then ask a question about it",
+            "match": {
+                "patterns": ["(?i)(?:in|from) (?:this|the) (?:pdf|document),? (?P<question>.+)"],
+                "keywords": ["pdf"]
+            },
+            "slots": {
+                "question": {"type": "text"},
+                "document": {"type": "file", "category": "document"}
+            },
+            "tasks": [
+                {"task_name": "upload", "service_id": "question-answering", "operation": "POST",
+                 "endpoint": "http://question-answering:5600/api/qa/upload", "input": "[FILE]{document}[/FILE]"},
+                {"task_name": "ask", "service_id": "question-answering", "operation": "POST",
+                 "endpoint": "http://question-answering:5600/api/qa/invoke", "input": "[TEXT]{question}[/TEXT]"}
+            ]
+        }
+
+    Lo slot `query` è sempre disponibile e contiene la query completa.
+
+    WORKFLOWS_PATH deve puntare a un volume montato, come LATENCY_MODEL_PATH.
+    """
+
+    def __init__(self, path=None):
+        self.path = path or os.environ.get("WORKFLOWS_PATH", "workflows.json")
+        self.enabled = os.environ.get("WORKFLOWS_ENABLED", "1") != "0"
+        self._lock = threading.Lock()
+        self._workflows = {}
+        self._patterns = {}
+        self.load()
+
+    # ---------- Storage ----------
+
+    def load(self):
+        if not self.path or not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            with self._lock:
+                self._workflows = data
+                self._patterns = {}
+        except Exception as e:
+            print(f"[WORKFLOWS] Failed to load {self.path}: {e}")
+
+    def _persist(self):
+        if not self.path:
+            return
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self._workflows, f, indent=2)
+        os.replace(tmp_path, self.path)
+
+    def validate(self, definition):
+        if not isinstance(definition, dict):
+            raise ValueError("Workflow definition must be a JSON object")
+        name = definition.get("name")
+        if not name or not isinstance(name, str):
+            raise ValueError("Missing 'name' field")
+
+        tasks = definition.get("tasks")
+        if not isinstance(tasks, list) or not tasks:
+            raise ValueError("'tasks' must be a non empty list")
+        for task in tasks:
+            if not isinstance(task, dict):
+                raise ValueError("Each task must be an object")
+            missing = [k for k in ("task_name", "endpoint", "operation") if not task.get(k)]
+            if missing:
+                raise ValueError(f"Task is missing fields: {', '.join(missing)}")
+            wrong = [k for k in ("task_name", "endpoint", "operation", "input") if k in task and not isinstance(task[k], str)]
+            if wrong:
+                raise ValueError(f"Task fields must be strings: {', '.join(wrong)}")
+            if task["operation"].upper() not in ("POST", "PUT", "GET", "DELETE"):
+                raise ValueError(f"Task has unsupported operation '{task['operation']}'")
+
+        slots = definition.get("slots", {})
+        if not isinstance(slots, dict):
+            raise ValueError("'slots' must be an object")
+        for slot, spec in slots.items():
+            if not isinstance(spec, dict):
+                raise ValueError(f"Slot '{slot}' must be an object")
+            if spec.get("type", "text") not in ("text", "file"):
+                raise ValueError(f"Slot '{slot}' has unsupported type '{spec.get('type')}'")
+
+        rules = definition.get("match", {})
+        if not isinstance(rules, dict):
+            raise ValueError("'match' must be an object")
+        for field in ("patterns", "keywords"):
+            values = rules.get(field, [])
+            if not isinstance(values, list) or not all(isinstance(v, str) for v in values):
+                raise ValueError(f"'match.{field}' must be a list of strings")
+        for pattern in rules.get("patterns", []):
+            try:
+                re.compile(pattern)
+            except re.error as e:
+                raise ValueError(f"Invalid pattern '{pattern}': {e}")
+        if not rules.get("patterns") and not rules.get("keywords"):
+            raise ValueError("'match' must define at least one pattern or keyword")
+
+    def register(self, definition):
+        self.validate(definition)
+        with self._lock:
+            versions = self._workflows.setdefault(definition["name"], [])
+            stored = dict(definition)
+            stored["version"] = versions[-1]["version"] + 1 if versions else 1
+            stored["created_at"] = time.time()
+            versions.append(stored)
+            self._patterns.pop(definition["name"], None)
+            self._persist()
+        return stored
+
+    def get(self, name, version=None):
+        with self._lock:
+            versions = self._workflows.get(name, [])
+            if version is None:
+                return versions[-1] if versions else None
+            return next((w for w in versions if w["version"] == version), None)
+
+    def list(self):
+        with self._lock:
+            return [dict(versions[-1], versions=len(versions)) for versions in self._workflows.values() if versions]
+
+    def delete(self, name, version=None):
+        with self._lock:
+            versions = self._workflows.get(name)
+            if not versions:
+                return False
+            if version is None:
+                del self._workflows[name]
+            else:
+                remaining = [w for w in versions if w["version"] != version]
+                if len(remaining) == len(versions):
+                    return False
+                if remaining:
+                    self._workflows[name] = remaining
+                else:
+                    del self._workflows[name]
+            self._patterns.pop(name, None)
+            self._persist()
+        return True
+
+    # ---------- Matching ----------
+
+    def _compiled(self, workflow):
+        name = workflow["name"]
+        cached = self._patterns.get(name)
+        if cached is None or cached[0] != workflow["version"]:
+            patterns = [re.compile(p) for p in workflow.get("match", {}).get("patterns", [])]
+            cached = (workflow["version"], patterns)
+            self._patterns[name] = cached
+        return cached[1]
+
+    def _fill_slots(self, workflow, query, analyzed_files, groups):
+        values = {"query": query}
+        values.update({k: v.strip() for k, v in groups.items() if v})
+        used_files = set()
+
+        for slot, spec in workflow.get("slots", {}).items():
+            if spec.get("type", "text") == "file":
+                category = spec.get("category")
+                candidate = next(
+                    (f for f in analyzed_files
+                     if f["filename"] not in used_files and (category is None or f.get("category") == category)),
+                    None
+                )
+                if candidate is None:
+                    return None
+                used_files.add(candidate["filename"])
+                values[slot] = candidate["filename"]
+            elif slot not in values:
+                if "default" not in spec:
+                    return None
+                values[slot] = spec["default"]
+        return values
+
+    def match(self, query, analyzed_files=None):
+        """Ritorna (workflow, slot) per il workflow più specifico che corrisponde alla query, oppure None."""
+        if not self.enabled:
+            return None
+        analyzed_files = analyzed_files or []
+        lowered = query.lower()
+
+        with self._lock:
+            candidates = [versions[-1] for versions in self._workflows.values() if versions]
+            compiled = {w["name"]: self._compiled(w) for w in candidates}
+
+        best = None
+        for workflow in candidates:
+            rules = workflow.get("match", {})
+            keywords = [k.lower() for k in rules.get("keywords", [])]
+            if not all(k in lowered for k in keywords):
+                continue
+
+            groups = {}
+            patterns = compiled[workflow["name"]]
+            if patterns:
+                found = next((m for m in (p.search(query) for p in patterns) if m), None)
+                if found is None:
+                    continue
+                groups = found.groupdict()
+
+            values = self._fill_slots(workflow, query, analyzed_files, groups)
+            if values is None:
+                continue
+
+            score = len(keywords) + (2 if patterns else 0) + len(workflow.get("slots", {}))
+            if best is None or score > best[0]:
+                best = (score, workflow, values)
+
+        if best is None:
+            return None
+        return best[1], best[2]
+
+    def instantiate(self, workflow, values):
+        def substitute(text, url=False):
+            def replace(m):
+                if m.group(1) not in values:
+                    return m.group(0)
+                value = str(values[m.group(1)])
+                return quote(value, safe="") if url else value
+            return SLOT_PATTERN.sub(replace, text)
+
+        tasks = []
+        for task in workflow["tasks"]:
+            instance = dict(task)
+            instance["endpoint"] = substitute(task["endpoint"], url=True)
+            instance["input"] = substitute(task.get("input", ""))
+            tasks.append(instance)
+
+        return {
+            "tasks": tasks,
+            "workflow": {"name": workflow["name"], "version": workflow["version"]}
+        }
@@ -1,17 +1,34 @@
-from flask import Flask, request, jsonify
-from pymongo import MongoClient
+from flask import Flask, Response, request, jsonify, stream_with_context
+from pymongo import MongoClient, ReplaceOne
+from pymongo.errors import BulkWriteError
 from qdrant_client import QdrantClient
-from qdrant_client.models import VectorParams, Distance, PointStruct
+from qdrant_client.models import (
+    VectorParams, Distance, PointStruct, SetPayload, SetPayloadOperation,
+    Filter, FieldCondition, MatchAny, MatchValue, PointIdsList, FilterSelector,
+    HnswConfigDiff, VectorParamsDiff, SearchParams, QuantizationSearchParams, PayloadSchemaType,
+    ScalarQuantization, ScalarQuantizationConfig, ScalarType,
+    ProductQuantization, ProductQuantizationConfig, CompressionRatio, Disabled
+)
 from bson import ObjectId
 from bson.json_util import dumps
 from cheroot.wsgi import Server as WSGIServer
-from sentence_transformers import SentenceTransformer, CrossEncoder
+from sentence_transformers import SentenceTransformer, CrossEncoder, export_dynamic_quantized_onnx_model
+from concurrent.futures import ThreadPoolExecutor, Future
+from collections import OrderedDict
+import urllib.request
+import numpy as np
 import multiprocessing
+import unicodedata
+import threading
+import hashlib
+import sqlite3
+import queue
+import math
+import re
 import uuid
 import os
 import sys
 import logging
-import bson
 import json
 import time
 
@@ -27,6 +44,100 @@ logging.basicConfig(
 
 logger = logging.getLogger("app")
 
+class Metrics:
+    """Contatori e riepiloghi (count/sum/max) condivisi tra i thread di cheroot, esposti da /metrics."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._gauges = {}
+        self._summaries = {}
+
+    def incr(self, name, value=1):
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + value
+
+    def set(self, name, value):
+        with self._lock:
+            self._gauges[name] = value
+
+    def observe(self, name, value):
+        with self._lock:
+            summary = self._summaries.setdefault(name, {"count": 0, "sum": 0.0, "max": 0.0})
+            summary["count"] += 1
+            summary["sum"] += value
+            summary["max"] = max(summary["max"], value)
+
+    def snapshot(self):
+        with self._lock:
+            summaries = {}
+            for name, s in self._summaries.items():
+                summaries[name] = dict(s, avg=s["sum"] / s["count"] if s["count"] else 0.0)
+            return {
+                "counters": dict(self._counters),
+                "gauges": dict(self._gauges),
+                "summaries": summaries
+            }
+
+metrics = Metrics()
+
+class MicroBatcher:
+    """
+    Raccoglie gli elementi inviati da più thread e li passa a `fn` a gruppi di al più
+    `max_batch`, attendendo al massimo `max_wait` secondi dal primo. Mentre tutti i
+    `workers` sono occupati la coda continua a crescere, quindi sotto carico i batch
+    si allargano da soli. `fn` riceve una lista e ritorna i risultati nello stesso ordine.
+    """
+
+    def __init__(self, name, fn, max_batch=32, max_wait=0.005, workers=1):
+        self.name = name
+        self.fn = fn
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self._queue = queue.Queue()
+        self._slots = threading.Semaphore(workers)
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix=name)
+        threading.Thread(target=self._collect, name=f"{name}-collector", daemon=True).start()
+
+    def submit(self, item):
+        future = Future()
+        self._queue.put((item, future, time.perf_counter()))
+        return future
+
+    def map(self, items):
+        futures = [self.submit(item) for item in items]
+        return [future.result() for future in futures]
+
+    def _collect(self):
+        while True:
+            batch = [self._queue.get()]
+            self._slots.acquire()
+            deadline = time.perf_counter() + self.max_wait
+            while len(batch) < self.max_batch:
+                timeout = deadline - time.perf_counter()
+                try:
+                    batch.append(self._queue.get(timeout=timeout) if timeout > 0 else self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            self._executor.submit(self._run, batch)
+
+    def _run(self, batch):
+        try:
+            now = time.perf_counter()
+            for _, _, queued_at in batch:
+                metrics.observe(f"{self.name}_queue_wait_seconds", now - queued_at)
+            metrics.observe(f"{self.name}_batch_size", len(batch))
+
+            results = self.fn([item for item, _, _ in batch])
+            for (_, future, _), result in zip(batch, results):
+                future.set_result(result)
+        except Exception as e:
+            for _, future, _ in batch:
+                if not future.done():
+                    future.set_exception(e)
+        finally:
+            self._slots.release()
+
 app = Flask(__name__)
 
 MONGO_USER = os.environ.get("MONGO_USER", "admin")
@@ -40,6 +151,21 @@ QDRANT_HOST = os.environ.get("QDRANT_HOST", "catalog-vector")
 QDRANT_PORT = os.environ.get("QDRANT_PORT", "6333")
 QDRANT_COLLECTION = os.environ.get("QDRANT_COLLECTION", "services")
 QDRANT_URI = f"http://{QDRANT_HOST}:{QDRANT_PORT}"
+QDRANT_GRPC_PORT = int(os.environ.get("QDRANT_GRPC_PORT", 6334))
+QDRANT_PREFER_GRPC = os.environ.get("QDRANT_PREFER_GRPC", "0") == "1"
+
+# Tuning della collezione: HNSW, quantizzazione, vettori su disco ed ef in ricerca
+QDRANT_HNSW_M = int(os.environ.get("QDRANT_HNSW_M", 16))
+QDRANT_HNSW_EF_CONSTRUCT = int(os.environ.get("QDRANT_HNSW_EF_CONSTRUCT", 100))
+QDRANT_SEARCH_EF = int(os.environ.get("QDRANT_SEARCH_EF", 0))
+QDRANT_ON_DISK = os.environ.get("QDRANT_ON_DISK", "0") == "1"
+QDRANT_QUANTIZATION = os.environ.get("QDRANT_QUANTIZATION", "none").lower()
+QDRANT_PQ_COMPRESSION = os.environ.get("QDRANT_PQ_COMPRESSION", "x16")
+QDRANT_QUANTIZATION_ALWAYS_RAM = os.environ.get("QDRANT_QUANTIZATION_ALWAYS_RAM", "1") == "1"
+QDRANT_RESCORE = os.environ.get("QDRANT_RESCORE", "1") == "1"
+QDRANT_OVERSAMPLING = float(os.environ.get("QDRANT_OVERSAMPLING", 2.0))
+QDRANT_MIGRATE = os.environ.get("QDRANT_MIGRATE", "1") == "1"
+QDRANT_PAYLOAD_INDEXES = ("mongo_id", "http_operation")
 
 # Connessioni inizializzate come None
 mongo_client = None
@@ -48,9 +174,90 @@ db = None
 collection = None
 
 is_server_ready = False
+
+# Campi del documento Mongo necessari per idratare i risultati della ricerca
+SEARCH_PROJECTION = {"name": 1, "description": 1, "capabilities": 1, "endpoints": 1}
+
+# Campi denormalizzati sui punti Qdrant: bastano a rispondere a /index/search senza Mongo
+PAYLOAD_FIELDS = ("mongo_id", "http_operation", "name", "description", "capability", "endpoint", "fragment", "token_count")
+
+INDEX_REPAIR_INTERVAL = float(os.environ.get("INDEX_REPAIR_INTERVAL", 3600))
+
+# Garbage collection dell'indice: punti orfani e servizi non più registrati su Consul
+REGISTRY_URL = os.environ.get("REGISTRY_URL", "")
+INDEX_GC_INTERVAL = float(os.environ.get("INDEX_GC_INTERVAL", 600))
+INDEX_GC_UNREGISTERED_GRACE = float(os.environ.get("INDEX_GC_UNREGISTERED_GRACE", 0))
+
+# Ricerca ristretta ai servizi registrati su Consul quando il chiamante non passa `service_ids`
+SEARCH_REGISTRY_FILTER = os.environ.get("SEARCH_REGISTRY_FILTER", "0") == "1"
+REGISTRY_SYNC_INTERVAL = float(os.environ.get("REGISTRY_SYNC_INTERVAL", 15))
+
+EMBED_BATCH_SIZE = int(os.environ.get("EMBED_BATCH_SIZE", 32))
+
+# Registrazione bulk: servizi elaborati insieme e punti per singolo upsert
+BULK_CHUNK_SERVICES = int(os.environ.get("BULK_CHUNK_SERVICES", 64))
+BULK_UPSERT_POINTS = int(os.environ.get("BULK_UPSERT_POINTS", 512))
+
+# Documenti letti per round trip dal cursore di GET /services
+SERVICES_PAGE_BATCH = int(os.environ.get("SERVICES_PAGE_BATCH", 100))
+
+# Embedding delle capability in registrazione: processi worker persistenti (0 = nel processo
+# del server) alimentati da una coda che raggruppa le richieste concorrenti
+EMBED_WORKERS = int(os.environ.get("EMBED_WORKERS", 0))
+EMBED_QUEUE_MAX_WAIT = float(os.environ.get("EMBED_QUEUE_MAX_WAIT", 0.01))
+
+# Micro-batching delle ricerche concorrenti: embedding delle query e coppie del reranker
+SEARCH_BATCHING = os.environ.get("SEARCH_BATCHING", "1") != "0"
+SEARCH_BATCH_MAX_WAIT = float(os.environ.get("SEARCH_BATCH_MAX_WAIT", 0.002))
+SEARCH_EMBED_MAX_BATCH = int(os.environ.get("SEARCH_EMBED_MAX_BATCH", 32))
+SEARCH_RERANK_MAX_BATCH = int(os.environ.get("SEARCH_RERANK_MAX_BATCH", 256))
+
+# Scritture su Mongo eseguite in parallelo agli upsert su Qdrant
+write_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="mongo-write")
+
+EMBEDDING_MODEL = os.environ.get("EMBEDDING_MODEL", "Qwen/Qwen3-Embedding-0.6B")
+RERANKER_MODEL = os.environ.get("RERANKER_MODEL", "cross-encoder/ms-marco-MiniLM-L-6-v2")
+
+# Backend di inferenza: "torch" (float32) oppure "onnx" (ONNX Runtime, quantizzazione dinamica int8)
+INFERENCE_BACKEND = os.environ.get("INFERENCE_BACKEND", "torch").lower()
+ONNX_CACHE_DIR = os.environ.get("ONNX_CACHE_DIR", "onnx-models")
+ONNX_QUANTIZATION = os.environ.get("ONNX_QUANTIZATION", "avx512_vnni")
+ONNX_INTRA_OP_THREADS = int(os.environ.get("ONNX_INTRA_OP_THREADS", 0))
+INFERENCE_PARITY_CHECK = os.environ.get("INFERENCE_PARITY_CHECK", "0") == "1"
+PARITY_MIN_COSINE = float(os.environ.get("PARITY_MIN_COSINE", 0.98))
+PARITY_MAX_RANK_CHANGES = int(os.environ.get("PARITY_MAX_RANK_CHANGES", 0))
+
+# Cache degli embedding delle query: limite in byte dei vettori in memoria, file sqlite opzionale
+EMBEDDING_CACHE_MAX_BYTES = int(os.environ.get("EMBEDDING_CACHE_MAX_BYTES", 64 * 1024 * 1024))
+EMBEDDING_CACHE_PATH = os.environ.get("EMBEDDING_CACHE_PATH", "")
+
+# Generazione dei candidati: "dense" (solo Qdrant) oppure "hybrid" (BM25 in memoria + Qdrant, fusi con RRF)
+SEARCH_MODE = os.environ.get("SEARCH_MODE", "dense").lower()
+SEARCH_CANDIDATES = int(os.environ.get("SEARCH_CANDIDATES", 20))
+SEARCH_MAX_K = int(os.environ.get("SEARCH_MAX_K", 100))
+SEARCH_MAX_TOKENS = int(os.environ.get("SEARCH_MAX_TOKENS", 7600))
+# Retrieval adattivo: soglia minima di similarità densa e taglio al primo salto di score
+SEARCH_MIN_SCORE = float(os.environ.get("SEARCH_MIN_SCORE", 0))
+SEARCH_SCORE_GAP = float(os.environ.get("SEARCH_SCORE_GAP", 0))
+SEARCH_RERANK_TOP = int(os.environ.get("SEARCH_RERANK_TOP", 20))
+RRF_K = int(os.environ.get("RRF_K", 60))
+# Query con match lessicale forte (tutti i termini nel primo hit) servite senza embedding né ANN
+LEXICAL_ONLY_COVERAGE = float(os.environ.get("LEXICAL_ONLY_COVERAGE", 1.0))
+LEXICAL_ONLY_MIN_TERMS = int(os.environ.get("LEXICAL_ONLY_MIN_TERMS", 2))
+
+# Reranking: cache dei punteggi del cross-encoder e cascata opzionale sugli score densi
+RERANK_CACHE_SIZE = int(os.environ.get("RERANK_CACHE_SIZE", 50000))
+RERANK_MARGIN = float(os.environ.get("RERANK_MARGIN", 0))
+RERANK_WINDOW = float(os.environ.get("RERANK_WINDOW", 0))
+RERANK_MIN_K = int(os.environ.get("RERANK_MIN_K", 5))
+
 embedding_model = None
 reranker_model = None
 tokenizer = None
+embedding_pool = None
+embedding_batcher = None
+query_batcher = None
+rerank_batcher = None
 
 def connect_with_retry(max_retries=5, initial_delay=2):
     """Connetti a MongoDB e Qdrant con retry"""
@@ -86,6 +293,8 @@ def connect_with_retry(max_retries=5, initial_delay=2):
             logger.info(f"Connecting to Qdrant ({attempt + 1}/{max_retries})...")
             qdrant_client = QdrantClient(
                 QDRANT_URI,
+                grpc_port=QDRANT_GRPC_PORT,
+                prefer_grpc=QDRANT_PREFER_GRPC,
                 timeout=30
             )
             qdrant_client.get_collections()
@@ -101,24 +310,113 @@ def connect_with_retry(max_retries=5, initial_delay=2):
                 logger.error("Failed to connect to Qdrant after all retries")
                 raise
 
-def load_model():
-    global embedding_model
-    global reranker_model
-    global tokenizer
-    logger.info("Loading models...")
-    embedding_model = SentenceTransformer(
-        model_name_or_path='Qwen/Qwen3-Embedding-0.6B',
+def load_onnx_model(model_class, model_id):
+    """
+    Carica il modello su ONNX Runtime con pesi int8. Al primo avvio il modello viene
+    esportato in ONNX dai pesi in cache, salvato in ONNX_CACHE_DIR e quantizzato.
+    """
+    import onnxruntime
+
+    local_dir = os.path.join(ONNX_CACHE_DIR, model_id.replace("/", "--"))
+    file_name = f"onnx/model_qint8_{ONNX_QUANTIZATION}.onnx"
+
+    if not os.path.exists(os.path.join(local_dir, file_name)):
+        logger.info(f"Exporting {model_id} to ONNX ({ONNX_QUANTIZATION})...")
+        exported = model_class(model_id, device='cpu', backend='onnx', trust_remote_code=True)
+        exported.save(local_dir)
+        export_dynamic_quantized_onnx_model(exported, ONNX_QUANTIZATION, local_dir)
+
+    session_options = onnxruntime.SessionOptions()
+    if ONNX_INTRA_OP_THREADS > 0:
+        session_options.intra_op_num_threads = ONNX_INTRA_OP_THREADS
+
+    return model_class(
+        local_dir,
+        device='cpu',
+        backend='onnx',
+        trust_remote_code=True,
+        model_kwargs={
+            "file_name": file_name,
+            "provider": "CPUExecutionProvider",
+            "session_options": session_options
+        }
+    )
+
+def build_embedding_model(backend=None):
+    if (backend or INFERENCE_BACKEND) == "onnx":
+        return load_onnx_model(SentenceTransformer, EMBEDDING_MODEL)
+    return SentenceTransformer(
+        model_name_or_path=EMBEDDING_MODEL,
         device='cpu',
         trust_remote_code=True
     )
-    tokenizer = embedding_model.tokenizer
-    logger.info("Embedding model loaded.")
-    reranker_model = CrossEncoder(
-        model_name_or_path='cross-encoder/ms-marco-MiniLM-L-6-v2',
+
+def build_reranker_model(backend=None):
+    if (backend or INFERENCE_BACKEND) == "onnx":
+        return load_onnx_model(CrossEncoder, RERANKER_MODEL)
+    return CrossEncoder(
+        model_name_or_path=RERANKER_MODEL,
         device='cpu',
         trust_remote_code=True
     )
+
+def load_model():
+    global embedding_model
+    global reranker_model
+    global tokenizer
+    if INFERENCE_BACKEND not in ("torch", "onnx"):
+        raise ValueError(f"Unsupported INFERENCE_BACKEND '{INFERENCE_BACKEND}'")
+    logger.info(f"Loading models ({INFERENCE_BACKEND} backend)...")
+    embedding_model = build_embedding_model()
+    tokenizer = embedding_model.tokenizer
+    logger.info("Embedding model loaded.")
+    reranker_model = build_reranker_model()
     logger.info("Reranker model loaded.")
+    metrics.set("inference_backend", INFERENCE_BACKEND)
+
+PARITY_QUERIES = [
+    "answer a question about an uploaded pdf document",
+    "fill the fields of a pdf form using a data document",
+    "upload a document to the knowledge base",
+    "list the registered services"
+]
+
+def check_backend_parity():
+    """
+    Confronta il backend attivo con PyTorch float32 sulle query di esempio e sulle
+    capability a catalogo: coseno minimo tra gli embedding e numero di query il cui
+    primo risultato del reranker cambia. Solleva un'eccezione se oltre le soglie.
+    """
+    if INFERENCE_BACKEND == "torch":
+        return None
+
+    capabilities = [
+        text for doc in collection.find({}, {"capabilities": 1}).limit(50)
+        for text in (doc.get("capabilities") or {}).values()
+    ] or PARITY_QUERIES
+
+    reference_embedding = build_embedding_model("torch")
+    reference_reranker = build_reranker_model("torch")
+
+    texts = [f"query: {t}" for t in PARITY_QUERIES + capabilities]
+    expected = reference_embedding.encode(texts, normalize_embeddings=True)
+    actual = embedding_model.encode(texts, normalize_embeddings=True)
+    min_cosine = float(np.min(np.sum(expected * actual, axis=1)))
+
+    rank_changes = 0
+    for query in PARITY_QUERIES:
+        pairs = [(query, capability) for capability in capabilities]
+        if int(np.argmax(reference_reranker.predict(pairs))) != int(np.argmax(reranker_model.predict(pairs))):
+            rank_changes += 1
+
+    report = {"backend": INFERENCE_BACKEND, "min_cosine": min_cosine, "rerank_top1_changes": rank_changes}
+    metrics.set("parity_min_cosine", min_cosine)
+    metrics.set("parity_rerank_top1_changes", rank_changes)
+    logger.info(f"Backend parity: {report}")
+
+    if min_cosine < PARITY_MIN_COSINE or rank_changes > PARITY_MAX_RANK_CHANGES:
+        raise RuntimeError(f"Backend parity check failed: {report}")
+    return report
 
 def clean_doc(doc):
     doc["_id"] = str(doc["_id"])
@@ -128,36 +426,838 @@ def embed(input):
     embedding = embedding_model.encode(f"query: {input}", convert_to_tensor=False, normalize_embeddings=True)
     return embedding.tolist()
 
+def embed_batch(texts):
+    """
+    Embedding di più testi con una sola chiamata a encode. I testi vengono ordinati
+    per lunghezza, così ogni batch interno ha poco padding, e riportati nell'ordine originale.
+    """
+    if not texts:
+        return []
+    order = sorted(range(len(texts)), key=lambda i: len(texts[i]))
+    embeddings = embedding_model.encode(
+        [f"query: {texts[i]}" for i in order],
+        batch_size=EMBED_BATCH_SIZE,
+        convert_to_tensor=False,
+        normalize_embeddings=True
+    )
+    vectors = [None] * len(texts)
+    for position, i in enumerate(order):
+        vectors[i] = embeddings[position].tolist()
+    return vectors
+
+def embed_documents(texts):
+    """Embedding per la registrazione, attraverso la coda condivisa quando è attiva."""
+    if embedding_batcher is None:
+        return embed_batch(texts)
+    return embedding_batcher.map(texts)
+
+def point_id(doc_id, http_op, capability):
+    """
+    Id del punto di una capability. Comprende servizio e operazione: due servizi che
+    pubblicano lo stesso testo hanno punti distinti, ciascuno col proprio payload.
+    """
+    return str(uuid.uuid5(uuid.NAMESPACE_DNS, json.dumps([doc_id, http_op, capability])))
+
+def plan_points(doc_id, doc):
+    """Modifiche all'indice vettoriale per la registrazione di un servizio."""
+    return plan_points_many([(doc_id, doc)])[0]
+
+def plan_points_many(services):
+    """
+    Confronta le capability in arrivo con i punti già su Qdrant. L'id del punto deriva
+    da servizio, operazione e testo della capability, quindi con un solo `retrieve` si
+    sa quali capability sono già indicizzate: vengono codificati solo quelli nuovi, per gli altri si aggiorna
+    al più il payload. I punti del servizio non più presenti vengono rimossi.
+    Ritorna, per ogni servizio, i punti da scrivere, i payload da aggiornare e gli id da cancellare.
+    """
+    operations = [
+        (index, doc_id, doc, http_op, capability, point_id(doc_id, http_op, capability))
+        for index, (doc_id, doc) in enumerate(services)
+        for http_op, capability in (doc.get("capabilities") or {}).items()
+    ]
+    plans = [{"points": [], "updates": [], "removed": [], "unchanged": 0} for _ in services]
+
+    ids = list({op[5] for op in operations})
+    existing = {}
+    if ids:
+        for point in qdrant_client.retrieve(collection_name=QDRANT_COLLECTION, ids=ids, with_payload=True, with_vectors=False):
+            existing[str(point.id)] = point.payload or {}
+
+    to_embed = []
+    for index, doc_id, doc, http_op, capability, vector_id in operations:
+        payload = point_payload(doc_id, doc, http_op)
+        current = existing.get(vector_id)
+        if current is None:
+            to_embed.append((index, vector_id, capability, payload))
+        elif any(current.get(field) != payload[field] for field in PAYLOAD_FIELDS):
+            plans[index]["updates"].append(SetPayloadOperation(set_payload=SetPayload(payload=payload, points=[vector_id])))
+        else:
+            plans[index]["unchanged"] += 1
+
+    # Lo stesso testo pubblicato da più servizi (es. "POST /register") si codifica una volta sola
+    texts = list(dict.fromkeys(capability for _, _, capability, _ in to_embed))
+    vectors = dict(zip(texts, embed_documents(texts))) if texts else {}
+    for index, vector_id, capability, payload in to_embed:
+        plans[index]["points"].append(PointStruct(id=vector_id, vector=vectors[capability], payload=payload))
+
+    # Punti ancora associati ai servizi ma con capability rimosse o modificate
+    service_index = {doc_id: index for index, (doc_id, _) in enumerate(services)}
+    keep = set(ids)
+    stored = scroll_points(scroll_filter=Filter(must=[
+        FieldCondition(key="mongo_id", match=MatchAny(any=list(service_index)))
+    ]))
+    for point in stored:
+        if str(point.id) not in keep:
+            plans[service_index[point.payload["mongo_id"]]]["removed"].append(str(point.id))
+
+    metrics.incr("registration_points_embedded_total", len(to_embed))
+    metrics.incr("registration_points_reused_total", len(operations) - len(to_embed))
+    return plans
+
+def write_points(plans):
+    """Applica su Qdrant le modifiche calcolate da plan_points_many, a blocchi di BULK_UPSERT_POINTS."""
+    points = [point for plan in plans for point in plan["points"]]
+    updates = [update for plan in plans for update in plan["updates"]]
+    removed = [pid for plan in plans for pid in plan["removed"]]
+
+    for start in range(0, len(points), BULK_UPSERT_POINTS):
+        qdrant_client.upsert(collection_name=QDRANT_COLLECTION, points=points[start:start + BULK_UPSERT_POINTS])
+    for start in range(0, len(updates), BULK_UPSERT_POINTS):
+        qdrant_client.batch_update_points(collection_name=QDRANT_COLLECTION, update_operations=updates[start:start + BULK_UPSERT_POINTS])
+    if removed:
+        qdrant_client.delete(collection_name=QDRANT_COLLECTION, points_selector=PointIdsList(points=removed))
+        metrics.incr("registration_points_removed_total", len(removed))
+
+    for point in points:
+        lexical_index.add(str(point.id), point.payload)
+    for update in updates:
+        for pid in update.set_payload.points:
+            lexical_index.add(str(pid), update.set_payload.payload)
+    lexical_index.remove(removed)
+
+def plan_summary(plan):
+    return {
+        "embedded": len(plan["points"]),
+        "updated": len(plan["updates"]),
+        "unchanged": plan["unchanged"],
+        "removed": len(plan["removed"])
+    }
+
+def store_service(doc_id, doc, plan):
+    """Scrive il documento su Mongo in parallelo alle modifiche dei punti su Qdrant."""
+    mongo_write = write_executor.submit(collection.replace_one, {"_id": doc_id}, doc, upsert=True)
+    try:
+        write_points([plan])
+    finally:
+        mongo_write.result()
+
+class EmbeddingCache:
+    """
+    LRU degli embedding delle query, condivisa tra i thread di cheroot.
+    La chiave combina id del modello e testo normalizzato; i vettori sono tenuti
+    in float32 entro `max_bytes` e, se è indicato un path, salvati anche su sqlite.
+    """
+
+    def __init__(self, model_id, max_bytes, path=None):
+        self.model_id = model_id
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._db = None
+        if path:
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            self._db.execute("CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, vector BLOB)")
+            self._db.commit()
+
+    @staticmethod
+    def normalize(text):
+        return " ".join(unicodedata.normalize("NFC", text).split())
+
+    def key(self, text):
+        return hashlib.sha256(f"{self.model_id}\0{self.normalize(text)}".encode("utf-8")).hexdigest()
+
+    def get(self, key):
+        with self._lock:
+            vector = self._entries.get(key)
+            if vector is not None:
+                self._entries.move_to_end(key)
+                return vector
+            if self._db is None:
+                return None
+            row = self._db.execute("SELECT vector FROM embeddings WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        vector = np.frombuffer(row[0], dtype=np.float32)
+        self._store(key, vector)
+        return vector
+
+    def put(self, key, vector):
+        vector = np.asarray(vector, dtype=np.float32)
+        self._store(key, vector)
+        if self._db is not None:
+            with self._lock:
+                self._db.execute("INSERT OR REPLACE INTO embeddings (key, vector) VALUES (?, ?)", (key, vector.tobytes()))
+                self._db.commit()
+
+    def _store(self, key, vector):
+        if vector.nbytes > self.max_bytes:
+            return
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self._bytes -= previous.nbytes
+            self._entries[key] = vector
+            self._bytes += vector.nbytes
+            while self._bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._bytes -= evicted.nbytes
+                metrics.incr("embedding_cache_evictions_total")
+            metrics.set("embedding_cache_entries", len(self._entries))
+            metrics.set("embedding_cache_bytes", self._bytes)
+
+embedding_cache = EmbeddingCache(f"{EMBEDDING_MODEL}@{INFERENCE_BACKEND}", EMBEDDING_CACHE_MAX_BYTES, EMBEDDING_CACHE_PATH or None)
+
+def embed_query(text):
+    """embed() con cache: query ripetute o ritentate non ricalcolano l'embedding."""
+    key = embedding_cache.key(text)
+    vector = embedding_cache.get(key)
+    if vector is not None:
+        metrics.incr("embedding_cache_hits_total")
+        return vector.tolist()
+
+    metrics.incr("embedding_cache_misses_total")
+    started = time.perf_counter()
+    if query_batcher is not None:
+        embedding = query_batcher.submit(text).result()
+    else:
+        embedding = embed(text)
+    metrics.observe("query_embedding_seconds", time.perf_counter() - started)
+    embedding_cache.put(key, embedding)
+    return embedding
+
+class LexicalIndex:
+    """
+    Indice BM25 in memoria sui testi delle capability (più il nome del servizio),
+    allineato ai punti Qdrant: stessi id e stesso payload denormalizzato.
+    """
+
+    TOKEN_PATTERN = re.compile(r"[a-z0-9]+")
+    STOPWORDS = {
+        "a", "an", "and", "are", "as", "at", "be", "by", "can", "do", "for", "from", "i", "in", "is", "it",
+        "me", "my", "of", "on", "or", "please", "the", "this", "to", "using", "want", "with", "you", "need"
+    }
+
+    def __init__(self, enabled, k1=1.2, b=0.75):
+        self.enabled = enabled
+        self.k1 = k1
+        self.b = b
+        self._lock = threading.Lock()
+        self._docs = {}
+        self._postings = {}
+        self._total_length = 0
+
+    @classmethod
+    def tokenize(cls, text):
+        return [t for t in cls.TOKEN_PATTERN.findall((text or "").lower()) if t not in cls.STOPWORDS]
+
+    def add(self, pid, payload):
+        if not self.enabled or not all(field in payload for field in PAYLOAD_FIELDS):
+            return
+        terms = self.tokenize(f"{payload['capability']} {payload['name']}")
+        frequencies = {}
+        for term in terms:
+            frequencies[term] = frequencies.get(term, 0) + 1
+        with self._lock:
+            self._remove(pid)
+            self._docs[pid] = {"payload": payload, "length": len(terms), "terms": frequencies}
+            self._total_length += len(terms)
+            for term, tf in frequencies.items():
+                self._postings.setdefault(term, {})[pid] = tf
+            metrics.set("lexical_index_documents", len(self._docs))
+
+    def remove(self, pids):
+        if not self.enabled:
+            return
+        with self._lock:
+            for pid in pids:
+                self._remove(str(pid))
+            metrics.set("lexical_index_documents", len(self._docs))
+
+    def remove_service(self, mongo_id):
+        if not self.enabled:
+            return
+        with self._lock:
+            pids = [pid for pid, doc in self._docs.items() if doc["payload"]["mongo_id"] == mongo_id]
+        self.remove(pids)
+
+    def _remove(self, pid):
+        doc = self._docs.pop(pid, None)
+        if doc is None:
+            return
+        self._total_length -= doc["length"]
+        for term in doc["terms"]:
+            postings = self._postings.get(term)
+            if postings is not None:
+                postings.pop(pid, None)
+                if not postings:
+                    del self._postings[term]
+
+    def rebuild(self):
+        if not self.enabled:
+            return
+        points = [(str(point.id), point.payload or {}) for point in scroll_points()]
+        with self._lock:
+            self._docs = {}
+            self._postings = {}
+            self._total_length = 0
+        for pid, payload in points:
+            self.add(pid, payload)
+        logger.info(f"Lexical index rebuilt with {len(self._docs)} capabilities")
+
+    def search(self, query, limit, allowed=None):
+        """
+        Ritorna (hits, coverage): i migliori `limit` hit (id, score, payload), eventualmente
+        ristretti ai servizi in `allowed`, e la frazione dei termini della query presenti nel primo.
+        """
+        terms = set(self.tokenize(query))
+        if not self.enabled or not terms:
+            return [], 0.0
+        with self._lock:
+            n_docs = len(self._docs)
+            if not n_docs:
+                return [], 0.0
+            avg_length = self._total_length / n_docs
+            scores = {}
+            for term in terms:
+                postings = self._postings.get(term)
+                if not postings:
+                    continue
+                idf = math.log(1 + (n_docs - len(postings) + 0.5) / (len(postings) + 0.5))
+                for pid, tf in postings.items():
+                    if allowed is not None and self._docs[pid]["payload"]["mongo_id"] not in allowed:
+                        continue
+                    length = self._docs[pid]["length"]
+                    norm = tf + self.k1 * (1 - self.b + self.b * length / avg_length)
+                    scores[pid] = scores.get(pid, 0.0) + idf * tf * (self.k1 + 1) / norm
+            ranked = sorted(scores.items(), key=lambda item: item[1], reverse=True)[:limit]
+            hits = [(pid, score, self._docs[pid]["payload"]) for pid, score in ranked]
+            coverage = len(terms & set(self._docs[ranked[0][0]]["terms"])) / len(terms) if ranked else 0.0
+        return hits, coverage
+
+lexical_index = LexicalIndex(SEARCH_MODE == "hybrid")
+
+def reciprocal_rank_fusion(*rankings):
+    """
+    Fonde liste di candidati (già ordinate) con RRF; il quarto campo diventa lo score fuso.
+    I candidati si identificano dal frammento, che contiene servizio e operazione.
+    """
+    scores = {}
+    candidates = {}
+    for ranking in rankings:
+        for rank, candidate in enumerate(ranking):
+            key = candidate[0]
+            scores[key] = scores.get(key, 0.0) + 1.0 / (RRF_K + rank + 1)
+            candidates.setdefault(key, candidate)
+    ordered = sorted(scores, key=scores.get, reverse=True)
+    return [candidates[key][:3] + (scores[key],) for key in ordered]
+
+class ScoreCache:
+    """LRU dei punteggi del cross-encoder per coppia (hash query, hash capability)."""
+
+    def __init__(self, model_id, max_entries):
+        self.model_id = model_id
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+
+    def key(self, query, capability):
+        query_hash = hashlib.sha256(f"{self.model_id}\0{EmbeddingCache.normalize(query)}".encode("utf-8")).hexdigest()
+        capability_hash = hashlib.sha256(capability.encode("utf-8")).hexdigest()
+        return query_hash, capability_hash
+
+    def get_many(self, keys):
+        with self._lock:
+            found = {}
+            for key in keys:
+                score = self._entries.get(key)
+                if score is not None:
+                    self._entries.move_to_end(key)
+                    found[key] = score
+            return found
+
+    def put_many(self, items):
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            for key, score in items:
+                self._entries[key] = score
+                self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+            metrics.set("rerank_cache_entries", len(self._entries))
+
+score_cache = ScoreCache(f"{RERANKER_MODEL}@{INFERENCE_BACKEND}", RERANK_CACHE_SIZE)
+
+def rerank(query_text, candidates, dense_scored=True):
+    """
+    Ordina i candidati per rilevanza.
+
+    Con RERANK_MARGIN > 0 il cross-encoder viene saltato quando il primo risultato
+    denso stacca il secondo di almeno quel margine; con RERANK_WINDOW > 0 vengono
+    rirankati solo i candidati entro quella distanza dal primo (almeno RERANK_MIN_K),
+    gli altri seguono in ordine denso. La cascata vale solo per candidati ordinati per
+    similarità coseno (`dense_scored`): score RRF o BM25 non sono confrontabili con le
+    soglie. I punteggi già calcolati vengono dalla cache.
+    """
+    started = time.perf_counter()
+    dense = [c[3] for c in candidates]
+    margin = RERANK_MARGIN if dense_scored else 0
+    window = RERANK_WINDOW if dense_scored else 0
+
+    if margin > 0 and (len(candidates) < 2 or dense[0] - dense[1] >= margin):
+        metrics.incr("rerank_skipped_total")
+        metrics.observe("rerank_seconds", time.perf_counter() - started)
+        return candidates
+
+    top_k = len(candidates)
+    if window > 0:
+        within = sum(1 for score in dense if dense[0] - score <= window)
+        top_k = min(len(candidates), max(RERANK_MIN_K, within))
+    head, tail = candidates[:top_k], candidates[top_k:]
+
+    keys = [score_cache.key(query_text, c[1]) for c in head]
+    scores = score_cache.get_many(keys)
+    missing = [i for i, key in enumerate(keys) if key not in scores]
+    metrics.incr("rerank_cache_hits_total", len(head) - len(missing))
+    metrics.incr("rerank_cache_misses_total", len(missing))
+
+    if missing:
+        pairs = [(query_text, head[i][1]) for i in missing]
+        predicted = rerank_batcher.map(pairs) if rerank_batcher is not None else reranker_model.predict(pairs)
+        computed = [(keys[i], float(score)) for i, score in zip(missing, predicted)]
+        scores.update(computed)
+        score_cache.put_many(computed)
+
+    order = sorted(range(len(head)), key=lambda i: scores[keys[i]], reverse=True)
+    metrics.observe("rerank_candidates", len(head))
+    metrics.observe("rerank_seconds", time.perf_counter() - started)
+    return [head[i] for i in order] + tail
+
 def count_tokens(text):
     tokens = tokenizer.encode(text, add_special_tokens=True)
     return len(tokens)
 
 def init_model():
-    global model
-    model = SentenceTransformer('Qwen/Qwen3-Embedding-0.6B', device='cpu')
-
-def embed_item(args):
-    doc_id, key, text = args
-    vector = model.encode(f"query: {text}", normalize_embeddings=True)
-    vector_id = str(uuid.uuid5(uuid.NAMESPACE_DNS, text))
-    return PointStruct(
-        id=vector_id,
-        vector=vector.tolist(),
-        payload={"mongo_id": doc_id, "http_operation": key}
+    """Initializer dei worker di embedding: il modello viene caricato una sola volta per processo."""
+    global embedding_model
+    embedding_model = build_embedding_model()
+
+def start_embedding_workers():
+    """
+    Avvia la coda di embedding per la registrazione e, con EMBED_WORKERS > 0, il pool di
+    processi persistenti. Va chiamata prima di connect_with_retry e load_model: il fork
+    avviene prima che il processo principale apra le connessioni a MongoDB e Qdrant,
+    carichi i modelli e avvii i thread di inferenza.
+    """
+    global embedding_pool, embedding_batcher
+
+    if EMBED_WORKERS > 0:
+        embedding_pool = multiprocessing.get_context("fork").Pool(processes=EMBED_WORKERS, initializer=init_model)
+        encode = lambda texts: embedding_pool.apply(embed_batch, (texts,))
+    else:
+        encode = embed_batch
+
+    embedding_batcher = MicroBatcher(
+        "embedding",
+        encode,
+        max_batch=EMBED_BATCH_SIZE,
+        max_wait=EMBED_QUEUE_MAX_WAIT,
+        workers=max(1, EMBED_WORKERS)
     )
 
+def predict_scores(pairs):
+    return [float(score) for score in reranker_model.predict(pairs)]
+
+def start_search_batchers():
+    """
+    Le ricerche concorrenti accodano embedding della query e coppie da rirankare:
+    un solo thread per modello esegue encode/predict sull'intero batch raccolto.
+    """
+    global query_batcher, rerank_batcher
+    if not SEARCH_BATCHING:
+        return
+    query_batcher = MicroBatcher("search_embedding", embed_batch, max_batch=SEARCH_EMBED_MAX_BATCH, max_wait=SEARCH_BATCH_MAX_WAIT)
+    rerank_batcher = MicroBatcher("search_rerank", predict_scores, max_batch=SEARCH_RERANK_MAX_BATCH, max_wait=SEARCH_BATCH_MAX_WAIT)
+
+def stop_embedding_workers():
+    if embedding_pool is not None:
+        embedding_pool.terminate()
+
+def service_entry(doc_id, name, description, http_operation, capability, endpoint):
+    """Singola capability di un servizio, nel formato restituito da /index/search."""
+    return {
+        "_id": doc_id,
+        "name": name,
+        "description": description,
+        "capabilities": {
+            http_operation: capability
+        },
+        "endpoints": {
+            http_operation: endpoint
+        }
+    }
+
+def point_payload(doc_id, doc, http_operation):
+    """
+    Payload denormalizzato del punto Qdrant di una capability, calcolato alla registrazione:
+    oltre ai campi del servizio contiene il frammento JSON restituito da /index/search e
+    il suo numero di token, così la ricerca non serializza né tokenizza nulla.
+    """
+    capability = doc["capabilities"][http_operation]
+    endpoint = (doc.get("endpoints") or {}).get(http_operation)
+    entry = service_entry(doc_id, doc.get("name"), doc.get("description"), http_operation, capability, endpoint)
+    fragment = json.dumps(entry)
+    return {
+        "mongo_id": doc_id,
+        "http_operation": http_operation,
+        "name": doc.get("name"),
+        "description": doc.get("description"),
+        "capability": capability,
+        "endpoint": endpoint,
+        "fragment": fragment,
+        "token_count": count_tokens(fragment)
+    }
+
+def hnsw_config():
+    return HnswConfigDiff(m=QDRANT_HNSW_M, ef_construct=QDRANT_HNSW_EF_CONSTRUCT, on_disk=QDRANT_ON_DISK)
+
+def quantization_config():
+    if QDRANT_QUANTIZATION == "none":
+        return None
+    if QDRANT_QUANTIZATION == "scalar":
+        return ScalarQuantization(scalar=ScalarQuantizationConfig(
+            type=ScalarType.INT8, quantile=0.99, always_ram=QDRANT_QUANTIZATION_ALWAYS_RAM
+        ))
+    if QDRANT_QUANTIZATION == "product":
+        return ProductQuantization(product=ProductQuantizationConfig(
+            compression=CompressionRatio(QDRANT_PQ_COMPRESSION), always_ram=QDRANT_QUANTIZATION_ALWAYS_RAM
+        ))
+    raise ValueError(f"Unsupported QDRANT_QUANTIZATION '{QDRANT_QUANTIZATION}'")
+
+def search_params():
+    quantization = None
+    if QDRANT_QUANTIZATION != "none":
+        quantization = QuantizationSearchParams(rescore=QDRANT_RESCORE, oversampling=QDRANT_OVERSAMPLING)
+    return SearchParams(hnsw_ef=QDRANT_SEARCH_EF or None, quantization=quantization)
+
+def ensure_payload_indexes(payload_schema):
+    for field in QDRANT_PAYLOAD_INDEXES:
+        if field not in payload_schema:
+            qdrant_client.create_payload_index(
+                collection_name=QDRANT_COLLECTION,
+                field_name=field,
+                field_schema=PayloadSchemaType.KEYWORD
+            )
+            logger.info(f"Created payload index on '{field}'")
+
+def migrate_vector_collection():
+    """
+    Allinea una collezione esistente alla configurazione corrente (HNSW, on_disk,
+    quantizzazione) con update_collection: Qdrant ricostruisce gli indici in background
+    senza reinserire i punti.
+    """
+    config = qdrant_client.get_collection(QDRANT_COLLECTION).config
+    hnsw = config.hnsw_config
+    vectors = config.params.vectors
+    current_on_disk = bool(getattr(vectors, "on_disk", False))
+    desired_quantization = quantization_config()
+
+    changes = {}
+    if hnsw.m != QDRANT_HNSW_M or hnsw.ef_construct != QDRANT_HNSW_EF_CONSTRUCT or bool(hnsw.on_disk) != QDRANT_ON_DISK:
+        changes["hnsw_config"] = hnsw_config()
+    if current_on_disk != QDRANT_ON_DISK:
+        changes["vectors_config"] = {"": VectorParamsDiff(on_disk=QDRANT_ON_DISK)}
+    if config.quantization_config != desired_quantization:
+        changes["quantization_config"] = desired_quantization or Disabled.DISABLED
+
+    if changes:
+        qdrant_client.update_collection(collection_name=QDRANT_COLLECTION, **changes)
+        logger.info(f"Collection '{QDRANT_COLLECTION}' migrated: {', '.join(changes)}")
+    return list(changes)
+
 def create_vector_collection():
     collection_name = QDRANT_COLLECTION
     existing_collections = qdrant_client.get_collections().collections
     if collection_name not in [col.name for col in existing_collections]:
         qdrant_client.create_collection(
             collection_name=collection_name,
-            vectors_config=VectorParams(size=1024, distance=Distance.COSINE)
+            vectors_config=VectorParams(size=1024, distance=Distance.COSINE, on_disk=QDRANT_ON_DISK),
+            hnsw_config=hnsw_config(),
+            quantization_config=quantization_config()
         )
+        ensure_payload_indexes({})
         return jsonify({"status": f"Collection '{collection_name}' created"}), 200
     else:
+        if QDRANT_MIGRATE:
+            migrate_vector_collection()
+        ensure_payload_indexes(qdrant_client.get_collection(collection_name).payload_schema or {})
         return jsonify({"status": f"Collection '{collection_name}' already exists"}), 200
 
+SEARCH_PARAMS = search_params()
+
+def hydrate_candidates(hits_by_service):
+    docs = hydrate_services(list(hits_by_service))
+
+    candidates = []
+    for doc_id, operations in hits_by_service.items():
+        retrieved = docs.get(doc_id)
+        if retrieved is None:
+            logger.error(f"Document not found for doc_id: {doc_id}")
+            continue
+
+        capabilities = retrieved.get("capabilities") or {}
+        endpoints = retrieved.get("endpoints") or {}
+        for http_operation, score in operations.items():
+            capability = capabilities.get(http_operation)
+            if capability is None:
+                logger.error(f"Error processing doc_id: {doc_id}, operation: {http_operation} - capability not found")
+                continue
+
+            entry = service_entry(
+                doc_id, retrieved.get("name"), retrieved.get("description"),
+                http_operation, capability, endpoints.get(http_operation)
+            )
+            fragment = json.dumps(entry)
+            candidates.append((fragment, capability, count_tokens(fragment), score))
+    return candidates
+
+def hydrate_services(doc_ids):
+    """Legge con una sola query $in i documenti dei servizi trovati, proiettando solo i campi usati."""
+    if not doc_ids:
+        return {}
+    cursor = collection.find({"_id": {"$in": doc_ids}}, SEARCH_PROJECTION)
+    docs = {doc["_id"]: doc for doc in cursor}
+    metrics.incr("mongo_round_trips_total")
+    return docs
+
+def scroll_points(with_vectors=False, scroll_filter=None):
+    offset = None
+    while True:
+        points, offset = qdrant_client.scroll(
+            collection_name=QDRANT_COLLECTION,
+            scroll_filter=scroll_filter,
+            limit=256,
+            offset=offset,
+            with_payload=True,
+            with_vectors=with_vectors
+        )
+        yield from points
+        if offset is None:
+            break
+
+def repair_index():
+    """
+    Riallinea l'indice vettoriale a Mongo, che resta la fonte di verità: reindicizza le
+    capability senza punto, riscrive i payload non aggiornati e conta i punti orfani.
+    """
+    started = time.perf_counter()
+    points = {str(point.id): point.payload or {} for point in scroll_points()}
+    referenced = set()
+    report = {"points": len(points), "missing": 0, "stale": 0, "orphaned": 0}
+
+    stale_updates = []
+    missing_points = []
+    for doc in collection.find({}, SEARCH_PROJECTION):
+        doc_id = doc["_id"]
+        for http_op, capability in (doc.get("capabilities") or {}).items():
+            vector_id = point_id(doc_id, http_op, capability)
+            referenced.add(vector_id)
+            expected = point_payload(doc_id, doc, http_op)
+
+            current = points.get(vector_id)
+            if current is None:
+                missing_points.append((vector_id, capability, expected))
+            elif any(current.get(field) != expected[field] for field in PAYLOAD_FIELDS):
+                stale_updates.append(SetPayloadOperation(set_payload=SetPayload(payload=expected, points=[vector_id])))
+
+    if missing_points:
+        vectors = embed_documents([capability for _, capability, _ in missing_points])
+        qdrant_client.upsert(
+            collection_name=QDRANT_COLLECTION,
+            points=[
+                PointStruct(id=vector_id, vector=vector, payload=expected)
+                for (vector_id, _, expected), vector in zip(missing_points, vectors)
+            ]
+        )
+    if stale_updates:
+        qdrant_client.batch_update_points(collection_name=QDRANT_COLLECTION, update_operations=stale_updates)
+
+    report["missing"] = len(missing_points)
+    report["stale"] = len(stale_updates)
+    report["orphaned"] = len(set(points) - referenced)
+    report["duration"] = time.perf_counter() - started
+
+    metrics.incr("index_repair_runs_total")
+    metrics.incr("index_repaired_points_total", report["missing"] + report["stale"])
+    metrics.set("index_orphaned_points", report["orphaned"])
+    lexical_index.rebuild()
+    logger.info(f"Index repair completed: {report}")
+    return report
+
+def start_index_repair():
+    if INDEX_REPAIR_INTERVAL <= 0:
+        return
+
+    def loop():
+        while True:
+            time.sleep(INDEX_REPAIR_INTERVAL)
+            try:
+                repair_index()
+            except Exception:
+                logger.exception("Index repair failed")
+
+    threading.Thread(target=loop, name="index-repair", daemon=True).start()
+
+def registered_service_ids():
+    """Id dei servizi registrati su Consul (anche tramite il meta service_doc_id), None se il registry non è raggiungibile."""
+    if not REGISTRY_URL:
+        return None
+    try:
+        with urllib.request.urlopen(f"{REGISTRY_URL}/v1/agent/services", timeout=5) as response:
+            services = json.loads(response.read())
+    except Exception as e:
+        logger.warning(f"Registry not reachable, skipping registry reconciliation: {e}")
+        return None
+
+    ids = set()
+    for service_id, info in services.items():
+        ids.add(info.get("ID", service_id))
+        doc_id = (info.get("Meta") or {}).get("service_doc_id")
+        if doc_id:
+            ids.add(doc_id)
+    return ids
+
+registry_snapshot = {"at": 0.0, "ids": None}
+registry_snapshot_lock = threading.Lock()
+
+def live_service_ids():
+    """Insieme dei servizi registrati, riletto da Consul al più ogni REGISTRY_SYNC_INTERVAL secondi."""
+    if not SEARCH_REGISTRY_FILTER:
+        return None
+    with registry_snapshot_lock:
+        if time.monotonic() - registry_snapshot["at"] < REGISTRY_SYNC_INTERVAL:
+            return registry_snapshot["ids"]
+        ids = registered_service_ids()
+        registry_snapshot["at"] = time.monotonic()
+        registry_snapshot["ids"] = ids
+        if ids is not None:
+            metrics.set("registry_live_services", len(ids))
+        return ids
+
+def delete_service_points(service_id):
+    """Rimuove i punti del servizio; gli id sono per servizio, quindi nessun altro documento li referenzia."""
+    lexical_index.remove_service(service_id)
+    qdrant_client.delete(
+        collection_name=QDRANT_COLLECTION,
+        points_selector=FilterSelector(filter=Filter(must=[
+            FieldCondition(key="mongo_id", match=MatchValue(value=service_id))
+        ]))
+    )
+
+# Servizi a catalogo assenti dal registry, con l'istante in cui sono stati visti mancare
+unregistered_since = {}
+
+def collect_garbage():
+    """
+    Riconcilia Qdrant, Mongo e Consul: cancella i punti che nessun documento Mongo
+    referenzia e, con INDEX_GC_UNREGISTERED_GRACE > 0, rimuove dal catalogo i servizi
+    assenti dal registry da più di quel numero di secondi.
+    """
+    started = time.perf_counter()
+    points = {str(point.id): (point.payload or {}).get("mongo_id") for point in scroll_points()}
+
+    referenced = set()
+    catalog_ids = set()
+    for doc in collection.find({}, {"capabilities": 1}):
+        catalog_ids.add(doc["_id"])
+        referenced.update(point_id(doc["_id"], http_op, c) for http_op, c in (doc.get("capabilities") or {}).items())
+
+    candidates = {pid: doc_id for pid, doc_id in points.items() if pid not in referenced}
+    # Una registrazione concorrente può aver scritto i punti prima del documento: si ricontrolla
+    if candidates:
+        owners = [doc_id for doc_id in set(candidates.values()) if doc_id is not None]
+        for doc in collection.find({"_id": {"$in": owners}}, {"capabilities": 1}):
+            for http_op, capability in (doc.get("capabilities") or {}).items():
+                candidates.pop(point_id(doc["_id"], http_op, capability), None)
+    if candidates:
+        qdrant_client.delete(collection_name=QDRANT_COLLECTION, points_selector=PointIdsList(points=list(candidates)))
+        lexical_index.remove(list(candidates))
+
+    report = {"points": len(points), "orphaned_points_deleted": len(candidates), "unregistered_services": None, "services_deleted": 0}
+
+    registered = registered_service_ids()
+    if registered is not None:
+        now = time.time()
+        unregistered = catalog_ids - registered
+        for doc_id in list(unregistered_since):
+            if doc_id not in unregistered:
+                del unregistered_since[doc_id]
+        for doc_id in unregistered:
+            since = unregistered_since.setdefault(doc_id, now)
+            if INDEX_GC_UNREGISTERED_GRACE > 0 and now - since >= INDEX_GC_UNREGISTERED_GRACE:
+                delete_service_points(doc_id)
+                collection.delete_one({"_id": doc_id})
+                del unregistered_since[doc_id]
+                report["services_deleted"] += 1
+                logger.info(f"Removed service {doc_id}: not registered for {int(now - since)}s")
+        report["unregistered_services"] = len(unregistered) - report["services_deleted"]
+        metrics.set("catalog_unregistered_services", report["unregistered_services"])
+
+    report["duration"] = time.perf_counter() - started
+    metrics.incr("index_gc_runs_total")
+    metrics.incr("index_gc_deleted_points_total", len(candidates))
+    metrics.incr("index_gc_deleted_services_total", report["services_deleted"])
+    metrics.set("index_orphaned_points", 0)
+    logger.info(f"Index GC completed: {report}")
+    return report
+
+def start_index_gc():
+    if INDEX_GC_INTERVAL <= 0:
+        return
+
+    def loop():
+        while True:
+            time.sleep(INDEX_GC_INTERVAL)
+            try:
+                collect_garbage()
+            except Exception:
+                logger.exception("Index GC failed")
+
+    threading.Thread(target=loop, name="index-gc", daemon=True).start()
+
+@app.route("/index/gc", methods=["POST"])
+def run_index_gc():
+    try:
+        report = collect_garbage()
+    except Exception as e:
+        logger.exception("Index GC failed")
+        return jsonify({"error": "Index GC failed", "details": str(e)}), 500
+    return jsonify(report), 200
+
+@app.route("/index/repair", methods=["POST"])
+def run_index_repair():
+    try:
+        report = repair_index()
+    except Exception as e:
+        logger.exception("Index repair failed")
+        return jsonify({"error": "Index repair failed", "details": str(e)}), 500
+    return jsonify(report), 200
+
+@app.route("/metrics")
+def get_metrics():
+    return jsonify(metrics.snapshot()), 200
+
 @app.route("/health")
 def index():
     if is_server_ready is True:
@@ -166,75 +1266,137 @@ def index():
         logger.error(f"Model not yet loaded or broken")
         return jsonify({"status": "error", "message": "Model not yet loaded or broken", "model_loaded": False}), 500
 
+def service_filter(allowed):
+    if allowed is None:
+        return None
+    return Filter(must=[FieldCondition(key="mongo_id", match=MatchAny(any=sorted(allowed)))])
+
+def score_gap_cutoff(results):
+    """Tronca i risultati (ordinati per score) al primo salto di score maggiore di SEARCH_SCORE_GAP."""
+    if SEARCH_SCORE_GAP <= 0:
+        return results
+    for i in range(len(results) - 1):
+        if results[i].score - results[i + 1].score > SEARCH_SCORE_GAP:
+            metrics.incr("search_gap_cutoffs_total")
+            return results[:i + 1]
+    return results
+
+def dense_candidates(query_text, allowed=None, k=SEARCH_CANDIDATES, min_score=SEARCH_MIN_SCORE):
+    """
+    Candidati dalla ricerca ANN su Qdrant, in ordine di score denso, ristretti ai servizi
+    in `allowed`: al più `k`, con similarità almeno `min_score` e tagliati al primo salto di score.
+    """
+    query_embedding = embed_query(query_text)
+
+    results = qdrant_client.search(
+        collection_name=QDRANT_COLLECTION,
+        query_vector=query_embedding,
+        query_filter=service_filter(allowed),
+        limit=k,
+        score_threshold=min_score or None,
+        search_params=SEARCH_PARAMS
+    )
+    results = score_gap_cutoff(results)
+
+    # I punti con payload completo non richiedono Mongo; quelli registrati prima
+    # della denormalizzazione vengono idratati raggruppandoli per servizio
+    candidates = []
+    legacy_hits = {}
+    for result in results:
+        payload = result.payload
+        if all(field in payload for field in PAYLOAD_FIELDS):
+            candidates.append((payload["fragment"], payload["capability"], payload["token_count"], result.score))
+        else:
+            operations = legacy_hits.setdefault(payload["mongo_id"], {})
+            operations.setdefault(payload["http_operation"], result.score)
+
+    if legacy_hits:
+        metrics.incr("search_legacy_hits_total", sum(len(ops) for ops in legacy_hits.values()))
+        candidates.extend(hydrate_candidates(legacy_hits))
+        candidates.sort(key=lambda c: c[3], reverse=True)
+    return candidates
+
 @app.route("/index/search", methods=["POST"])
 def vector_search():
     data = request.get_json()
     if not data or "query" not in data:
         return jsonify({"error": "Missing 'query' field"}), 400
+    if not isinstance(data["query"], str) or not data["query"].strip():
+        return jsonify({"error": "'query' must be a non empty string"}), 400
 
+    service_ids = data.get("service_ids")
+    if service_ids is not None and (not isinstance(service_ids, list) or not all(isinstance(i, str) for i in service_ids)):
+        return jsonify({"error": "'service_ids' must be a list of strings"}), 400
+
+    # Override per richiesta di numero di candidati, budget di token e soglia di similarità
+    k = data.get("k", SEARCH_CANDIDATES)
+    max_tokens = data.get("max_tokens", SEARCH_MAX_TOKENS)
+    min_score = data.get("min_score", SEARCH_MIN_SCORE)
+    if not isinstance(k, int) or isinstance(k, bool) or k <= 0:
+        return jsonify({"error": "'k' must be a positive integer"}), 400
+    if not isinstance(max_tokens, int) or isinstance(max_tokens, bool) or max_tokens <= 0:
+        return jsonify({"error": "'max_tokens' must be a positive integer"}), 400
+    if not isinstance(min_score, (int, float)) or isinstance(min_score, bool):
+        return jsonify({"error": "'min_score' must be a number"}), 400
+    k = min(k, SEARCH_MAX_K)
+
+    metrics.incr("searches_total")
     query_text = data["query"]
-    query_embedding = embed(query_text)
 
-    results = qdrant_client.search(
-        collection_name=QDRANT_COLLECTION,
-        query_vector=query_embedding,
-        limit=20
-    )
+    # Solo i servizi raggiungibili: lista del chiamante oppure insieme sincronizzato da Consul
+    allowed = set(service_ids) if service_ids is not None else live_service_ids()
+    if allowed is not None:
+        metrics.incr("search_filtered_total")
+        if not allowed:
+            return jsonify({"results": [], "considered": 0}), 200
 
-    services = []
-    rerank_texts = []
-    for result in results:
-        doc_id = result.payload["mongo_id"]
-        http_operation = result.payload["http_operation"]
+    lexical_hits, coverage = lexical_index.search(query_text, k, allowed)
+    lexical_candidates = [
+        (payload["fragment"], payload["capability"], payload["token_count"], score)
+        for _, score, payload in lexical_hits
+    ]
 
-        retrieved = collection.find_one({"_id": doc_id})
-        retrieved = bson.json_util.loads(dumps(retrieved))
-        try:
-            name = retrieved.get("name")
-            description = retrieved.get("description")
-            capabilities = retrieved.get("capabilities")
-            capability = capabilities.get(http_operation)
-            endpoints = retrieved.get("endpoints")
-            endpoint = endpoints.get(http_operation)
-
-            service = {
-                "_id": doc_id,
-                "name": name,
-                "description": description,
-                "capabilities": {
-                    http_operation: capability
-                },
-                "endpoints": {
-                    http_operation: endpoint
-                }
-            }
+    lexical_only = (
+        lexical_candidates
+        and coverage >= LEXICAL_ONLY_COVERAGE
+        and len(set(LexicalIndex.tokenize(query_text))) >= LEXICAL_ONLY_MIN_TERMS
+    )
 
-            rerank_texts.append(capability)
-            services.append(service)
-        except Exception as e:
-            logger.error(f"Error processing doc_id: {doc_id}, operation: {http_operation} - {str(e)}")
-    
-    rerank_inputs = [(query_text, cap_text) for cap_text in rerank_texts]
-    scores = reranker_model.predict(rerank_inputs)
+    if lexical_only:
+        metrics.incr("search_lexical_only_total")
+        candidates = lexical_candidates
+    elif lexical_index.enabled:
+        candidates = reciprocal_rank_fusion(dense_candidates(query_text, allowed, k, min_score), lexical_candidates)
+    else:
+        candidates = dense_candidates(query_text, allowed, k, min_score)
 
-    reranked = sorted(zip(services, scores), key=lambda x: x[1], reverse=True)
-    ordered_services = [doc for doc, _ in reranked]
+    if not candidates:
+        return jsonify({"results": [], "considered": 0}), 200
 
-    max_tokens = 7600
+    # Al cross-encoder vanno i primi SEARCH_RERANK_TOP candidati, o i k chiesti esplicitamente
+    rerank_top = k if "k" in data else SEARCH_RERANK_TOP
+    considered = candidates[:rerank_top]
+    metrics.observe("search_considered", len(considered))
+    # Nel modo ibrido e lessicale il quarto campo è uno score RRF o BM25, non una similarità coseno
+    ordered_candidates = rerank(query_text, considered, dense_scored=not lexical_index.enabled)
+
+    # Packing greedy nel budget: i frammenti troppo grandi vengono saltati
+    # e si prova con i successivi, senza fermarsi al primo che non entra
     current_tokens = 0
     top_results = []
-    
-    for s in ordered_services:
-        serialized = json.dumps(s)
-        n_tokens = count_tokens(serialized)
 
-        if current_tokens + n_tokens <= max_tokens:
-            top_results.append(s)
-            current_tokens += n_tokens
-        else:
+    for fragment, _, n_tokens, _ in ordered_candidates:
+        if current_tokens + n_tokens > max_tokens:
+            metrics.incr("search_budget_skipped_total")
+            continue
+        top_results.append(fragment)
+        current_tokens += n_tokens
+        if current_tokens >= max_tokens:
             break
-            
-    return jsonify({"results": top_results}), 200
+
+    # I frammenti sono già JSON: il body viene composto senza riserializzare
+    body = '{"results": [' + ", ".join(top_results) + '], "considered": ' + str(len(considered)) + '}'
+    return Response(body, status=200, mimetype="application/json")
 
 @app.route("/service", methods=["POST"])
 def create_or_update_service_old():
@@ -246,27 +1408,16 @@ def create_or_update_service_old():
     data["_id"] = doc_id
     data.pop("id", None)
 
-    capabilities = data.get("capabilities")
-    for http_op, capability in capabilities.items():
-        embedding = embed(capability)
-        print(f"EMBEDDING DIM: {len(embedding)}")
-        vector_id = str(uuid.uuid5(uuid.NAMESPACE_DNS, capability))
-        qdrant_client.upsert(
-            collection_name=QDRANT_COLLECTION,
-            points=[
-                PointStruct(
-                    id=vector_id,
-                    vector=embedding,
-                    payload={
-                                "mongo_id": doc_id, 
-                                "http_operation": http_op
-                            }
-                )
-            ]
-        )
+    started = time.perf_counter()
+    try:
+        plan = plan_points(doc_id, data)
+    except Exception as e:
+        logger.exception("Embedding failed")
+        return jsonify({"error": "Embedding failed", "details": str(e)}), 500
 
-    collection.replace_one({"_id": doc_id}, data, upsert=True)
-    return jsonify({"status": "ok", "id": doc_id}), 200
+    store_service(doc_id, data, plan)
+    metrics.observe("registration_seconds", time.perf_counter() - started)
+    return jsonify(dict({"status": "ok", "id": doc_id}, **plan_summary(plan))), 200
 
 @app.route("/service/old", methods=["POST"])
 def create_or_update_service():
@@ -278,28 +1429,154 @@ def create_or_update_service():
     data["_id"] = doc_id
     data.pop("id", None)
     
-    capabilities = data.get("capabilities")
-    input_data = [(doc_id, k, v) for k, v in capabilities.items()]
-
+    # Stessa pipeline di /service: i worker di embedding sono quelli persistenti
     try:
-        with multiprocessing.Pool(initializer=init_model) as pool:
-            points = pool.map(embed_item, input_data)
+        plan = plan_points(doc_id, data)
     except Exception as e:
         logger.exception("Embedding failed")
         return jsonify({"error": "Embedding failed", "details": str(e)}), 500
 
-    qdrant_client.upsert(
-        collection_name=QDRANT_COLLECTION,
-        points=points
-    )
-
-    collection.replace_one({"_id": doc_id}, data, upsert=True)
+    store_service(doc_id, data, plan)
     return jsonify({"status": "ok", "id": doc_id}), 200
 
+def parse_bulk_line(line):
+    data = json.loads(line)
+    if not isinstance(data, dict) or "id" not in data:
+        raise ValueError("Missing 'id' field")
+    if not isinstance(data.get("capabilities"), dict):
+        raise ValueError("'capabilities' must be an object")
+    if not all(isinstance(k, str) and isinstance(v, str) for k, v in data["capabilities"].items()):
+        raise ValueError("'capabilities' values must be strings")
+    if "endpoints" in data and not isinstance(data["endpoints"], dict):
+        raise ValueError("'endpoints' must be an object")
+    doc_id = data.pop("id")
+    data["_id"] = doc_id
+    return doc_id, data
+
+def store_services_bulk(services):
+    """
+    Registra un gruppo di servizi: embedding in batch delle sole capability nuove,
+    scritture su Qdrant a blocchi e bulk_write su Mongo in parallelo.
+    Ritorna lo stato di ogni servizio.
+    """
+    errors = {}
+    try:
+        plans = plan_points_many(services)
+    except Exception as e:
+        logger.exception("Bulk embedding failed")
+        return [{"id": doc_id, "status": "error", "error": f"Embedding failed: {e}"} for doc_id, _ in services]
+
+    writes = [ReplaceOne({"_id": doc_id}, doc, upsert=True) for doc_id, doc in services]
+    mongo_write = write_executor.submit(collection.bulk_write, writes, ordered=False)
+
+    try:
+        write_points(plans)
+    except Exception as e:
+        logger.exception("Bulk upsert failed")
+        for index in range(len(services)):
+            errors[index] = f"Vector upsert failed: {e}"
+
+    try:
+        mongo_write.result()
+    except BulkWriteError as e:
+        for write_error in e.details.get("writeErrors", []):
+            errors.setdefault(write_error["index"], f"Mongo write failed: {write_error.get('errmsg')}")
+    except Exception as e:
+        logger.exception("Bulk Mongo write failed")
+        for index in range(len(services)):
+            errors.setdefault(index, f"Mongo write failed: {e}")
+
+    statuses = []
+    for index, (doc_id, _) in enumerate(services):
+        if index in errors:
+            statuses.append({"id": doc_id, "status": "error", "error": errors[index]})
+        else:
+            statuses.append(dict({"id": doc_id, "status": "ok"}, **plan_summary(plans[index])))
+    return statuses
+
+@app.route("/services/bulk", methods=["POST"])
+def create_or_update_services_bulk():
+    """
+    Registrazione di molti servizi da un body NDJSON (un servizio per riga, stesso
+    formato di /service). Il body viene letto in streaming, i servizi elaborati a
+    gruppi di BULK_CHUNK_SERVICES e lo stato di ognuno restituito come riga NDJSON.
+    """
+    stream = request.stream
+
+    def generate():
+        started = time.perf_counter()
+        pending = []
+        totals = {"ok": 0, "error": 0}
+
+        def flush():
+            for status in store_services_bulk(pending):
+                totals[status["status"]] += 1
+                yield json.dumps(status) + "\n"
+            pending.clear()
+
+        for line_number, raw in enumerate(stream, start=1):
+            line = raw.strip()
+            if not line:
+                continue
+            try:
+                pending.append(parse_bulk_line(line))
+            except ValueError as e:
+                totals["error"] += 1
+                yield json.dumps({"line": line_number, "status": "error", "error": str(e)}) + "\n"
+                continue
+            if len(pending) >= BULK_CHUNK_SERVICES:
+                yield from flush()
+
+        if pending:
+            yield from flush()
+
+        metrics.incr("bulk_registered_services_total", totals["ok"])
+        metrics.observe("bulk_registration_seconds", time.perf_counter() - started)
+        yield json.dumps({"status": "done", "registered": totals["ok"], "failed": totals["error"]}) + "\n"
+
+    return Response(stream_with_context(generate()), status=200, mimetype="application/x-ndjson")
+
 @app.route("/services", methods=["GET"])
 def list_services():
-    docs = list(collection.find())
-    return dumps(docs), 200 
+    """
+    Lista dei servizi in ordine di _id, scritta in streaming man mano che il cursore
+    restituisce i documenti. Parametri opzionali: `limit` (dimensione della pagina),
+    `after` (ultimo _id della pagina precedente, letto da X-Next-Cursor) e `fields`
+    (campi da restituire, separati da virgola).
+    """
+    limit = request.args.get("limit", type=int)
+    after = request.args.get("after")
+    fields = request.args.get("fields")
+
+    if limit is not None and limit <= 0:
+        return jsonify({"error": "'limit' must be a positive integer"}), 400
+
+    query = {"_id": {"$gt": after}} if after else {}
+    projection = {field.strip(): 1 for field in fields.split(",") if field.strip()} if fields else None
+
+    headers = {}
+    page_query = query
+    if limit is not None:
+        # Il cursore della pagina successiva si ricava dagli _id, senza leggere i documenti
+        boundary = list(collection.find(query, {"_id": 1}).sort("_id", 1).skip(limit - 1).limit(2))
+        if boundary:
+            # La pagina si ferma al confine: inserimenti concorrenti non possono farla
+            # divergere dal cursore annunciato in X-Next-Cursor
+            page_query = {"_id": {**query.get("_id", {}), "$lte": boundary[0]["_id"]}}
+        if len(boundary) == 2:
+            headers["X-Next-Cursor"] = str(boundary[0]["_id"])
+
+    cursor = collection.find(page_query, projection).sort("_id", 1).batch_size(SERVICES_PAGE_BATCH)
+    if limit is not None:
+        cursor = cursor.limit(limit)
+
+    def generate():
+        yield "["
+        for position, doc in enumerate(cursor):
+            yield ("," if position else "") + dumps(doc)
+        yield "]"
+
+    return Response(generate(), status=200, headers=headers, mimetype="application/json")
 
 @app.route("/services/<string:service_id>", methods=["GET"])
 def get_service(service_id):
@@ -310,6 +1587,8 @@ def get_service(service_id):
 
 @app.route("/services/<string:service_id>", methods=["DELETE"])
 def delete_service(service_id):
+    # I punti vanno rimossi anche se il documento manca, per non lasciare orfani nell'indice
+    delete_service_points(service_id)
     result = collection.delete_one({"_id": service_id})
     if result.deleted_count == 0:
         return jsonify({"error": "Service not found"}), 404
@@ -318,15 +1597,26 @@ def delete_service(service_id):
 if __name__ == "__main__":
     try:
         with app.app_context():
+            # Il fork dei worker precede le connessioni: i client pymongo e gRPC non sono fork-safe
+            logger.info("⚙️ Starting embedding workers...")
+            start_embedding_workers()
+
             logger.info("🔗 Connecting to databases...")
             connect_with_retry(max_retries=5, initial_delay=2)
             
             logger.info("🛠️ Creating Qdrant collection...")
             create_vector_collection()
-            
+            lexical_index.rebuild()
+
             logger.info("📦 Loading embedding model...")
             load_model()
-            
+            if INFERENCE_PARITY_CHECK:
+                check_backend_parity()
+
+            start_search_batchers()
+            start_index_repair()
+            start_index_gc()
+
             is_server_ready = True
             logger.info("✅ Server is ready.")
     except Exception as e:
@@ -339,4 +1629,5 @@ if __name__ == "__main__":
         server.start()
     except KeyboardInterrupt:
         print("🛑 Shutting down server...")
-        server.stop()
\ No newline at end of file
+        server.stop()
+        stop_embedding_workers()
\ No newline at end of file
@@ -213,6 +213,8 @@ class Registration(Resource):
         consul_payload = {
             "Name": service_name,
             "Id": service_id,
+            "Address": SERVICE_HOST,
+            "Port": SERVICE_PORT,
             "Meta": {
                 "service_doc_id": service_id
             },